@@ -4,20 +4,36 @@
 @Purpose: Create a user-friendly GUI interface to compare graduate school programs.
 """
 
+import json
 import os
+import queue
 import shutil
-import time
+import threading
 import tkinter as tk
+import webbrowser
 from tkinter import ttk
-import pandas as pd
-import matplotlib.pyplot as plt
-from map_plot import map_plot
+import numpy as np
+from map_plot import HAS_KALEIDO, render_map
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
 import Pmw
-from data_collection import (collect_and_clean_pop, collect_and_clean_safety,
-                             collect_and_clean_weather, collect_and_clean_program)
-from data_cleaning_merge import merge
-from create_scatterplot import prep_weather_data_for_scatterplot
+from data_store import dataset_version, read_table
+from instrumentation import start_run
+from pipeline import refresh
+from program_index import ProgramIndex
+from ranking_engine import RANKING_FEATURES, RankingEngine
+from similar_programs import SIMILARITY_FEATURES, similarity_index
+
+# Number of programs inserted in the text box at a time
+PAGE_SIZE = 20
+MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+# Number of alternatives listed for the selected university
+SIMILAR_SIZE = 10
+# Number of programs listed by the Rank mode, and the slider label and default weight of every criterion
+RANK_SIZE = 50
+WEIGHT_SLIDERS = {"Out_of_State_Tuition": ("Low tuition", 1), "Total_criminal_count": ("Safety", 1),
+                  "Temperature_avg": ("Warmth", 0), "Population_estimate_2022": ("City size", 0),
+                  "Points": ("Points", 0), "Ranking": ("Ranking", 1)}
 
 
 class CompassApp:
@@ -34,6 +50,11 @@ class CompassApp:
         self.canvas1 = None
         self.canvas2 = None
         self.canvas3 = None
+        self.scatter_figure = None
+        self.scatter_axes = None
+        self.scatter_points = None
+        self.map_label = None
+        self.map_image = None
 
         # Load data
         self.labels = ["Ranking", "State", "City", "University", "Points", "population_category",
@@ -45,12 +66,16 @@ class CompassApp:
                                 ["temperature_category", "Temperature_avg_spring", "Temperature_avg_summer",
                                  "Temperature_avg_fall", "Temperature_avg_winter"],
                                 ["Description"]]
-        self.collect_funcs = [collect_and_clean_pop, collect_and_clean_safety,
-                              collect_and_clean_weather, collect_and_clean_program,
-                              merge,
-                              prep_weather_data_for_scatterplot]
         self.df = None
         self.df_weather = None
+        self.index = None
+        self.ranker = None
+        self.weight_vars = {}
+        self.data_version = None
+        self.weather_by_university = {}
+        self.result_data = None
+        self.rendered_count = 0
+        self.progress_queue = queue.Queue()
         self.create_first_canvas()
 
     def create_first_canvas(self):
@@ -81,6 +106,11 @@ class CompassApp:
         self.progress_label_scrape = tk.Label(self.canvas1, text="0%", anchor='w')
         self.progress_label_scrape.pack(side="left", padx=10)
 
+        # By default only the sources that changed upstream are scraped again
+        self.full_refresh_var = tk.BooleanVar(value=False)
+        self.check_full_refresh = tk.Checkbutton(self.canvas1, text="Full refresh", variable=self.full_refresh_var)
+        self.check_full_refresh.pack(side="left", padx=10)
+
         self.btn_use = tk.Button(self.canvas1, text="Use Scraped Data", command=lambda: self.set_choice("use"))
         self.btn_use.pack(side="right", padx=10)
 
@@ -98,6 +128,9 @@ class CompassApp:
         Create the second canvas to filter programs and plot diagrams.
         """
         self.canvas2 = tk.Frame(self.root)
+        # The scatter chart and the map are created again on the new frame
+        self.canvas3 = None
+        self.map_label = None
 
         # Create drop-down boxes
         self.create_comboboxes()
@@ -107,13 +140,27 @@ class CompassApp:
         self.view_button.grid(row=4, column=3, padx=5, pady=5)
 
         # Create text box to show the information about university
-        self.text = tk.Text(self.canvas2, wrap=tk.WORD, width=100, height=20)
+        self.text = tk.Text(self.canvas2, wrap=tk.WORD, width=100, height=20, yscrollcommand=self.on_text_scroll)
         self.text.grid(row=5, column=0, columnspan=30, padx=5, pady=5)
 
         # Create a plot button to draw diagram
         self.plot_button = ttk.Button(self.canvas2, text="Plot", command=self.plot_data)
         self.plot_button.grid(row=4, column=6, padx=5, pady=5)
 
+        # Create sliders to weight the ranking criteria, and a button to rank the filtered programs
+        self.weight_frame = tk.Frame(self.canvas2)
+        self.weight_frame.grid(row=3, column=0, columnspan=12, sticky='w')
+        for feature in RANKING_FEATURES:
+            text, default = WEIGHT_SLIDERS[feature]
+            self.weight_vars[feature] = tk.DoubleVar(value=default)
+            ttk.Label(self.weight_frame, text=text).pack(side="left", padx=3)
+            tk.Scale(self.weight_frame, variable=self.weight_vars[feature], from_=-5, to=5, resolution=1,
+                     orient=tk.HORIZONTAL, length=80).pack(side="left", padx=3)
+        self.rank_button = ttk.Button(self.canvas2, text="Rank", command=self.rank_programs)
+        self.rank_button.grid(row=4, column=5, padx=5, pady=5)
+        self.similar_button = ttk.Button(self.canvas2, text="Similar", command=self.show_similar)
+        self.similar_button.grid(row=4, column=8, padx=5, pady=5)
+
         # Create a reset button to clear the selected values of all filters
         self.reset_button = ttk.Button(self.canvas2, text="Reset", command=self.reset)
         self.reset_button.grid(row=4, column=4, padx=5, pady=5)
@@ -124,6 +171,10 @@ class CompassApp:
 
         # # Add a hint to the view and plot button
         self.tip.bind(self.view_button, "Select criteria values, press filter and display information of university.")
+        self.tip.bind(self.rank_button, "Rank the programs matching the filters by the weighted criteria.\n"
+                                        "A negative weight prefers the other end, e.g. colder or smaller cities.")
+        self.tip.bind(self.similar_button, "Select a university to list the programs closest to it by tuition, "
+                                           "safety, climate, city size and ranking, within the other filters.")
         self.tip.bind(self.plot_button, "Scatter: select a university to plot the monthly temperature scatter chart.\n"
                                         "Map: directly click the Plot button to draw a map to display university counts in each state.")
 
@@ -139,49 +190,96 @@ class CompassApp:
         self.choice_var.set(choice)
 
         if choice == "scrape":
-            progress_bar = self.progress_scrape
-            progress_label = self.progress_label_scrape
-
-            # Remove the previous data folders and data files.
-            self.clear_scraped_data()
-
-            # Scrape websites, clean data and merge data. Display progress bar in UI interface.
-            data_list = []
-            for i, func in enumerate(self.collect_funcs):
-                # Scrape data from four sources
-                if i < 4:
-                    data_list.append(func())
-                # Clean and merge those scraped data
-                elif i == 4:
-                    self.df = func(*data_list)
-                else:
-                    # Load monthly temperature data to draw scatterplot
-                    self.df_weather = func()
-                # Display progress bar
-                progress_value = 100 if i == 5 else (i + 1) * 16
-                progress_bar['value'] = progress_value
-                progress_label['text'] = f"{progress_value}%"
-                self.root.update_idletasks()
+            # Remove the previous data folders and data files for a full refresh.
+            full_refresh = self.full_refresh_var.get()
+            if full_refresh:
+                self.clear_scraped_data()
+
+            # Scrape websites, clean data and merge data in a worker thread so the window stays responsive.
+            # The worker posts progress events to a queue that is polled from the Tk main loop.
+            self.btn_scrape.config(state=tk.DISABLED)
+            self.btn_use.config(state=tk.DISABLED)
+            threading.Thread(target=self.run_refresh, args=(full_refresh,), daemon=True).start()
+            self.root.after(100, self.poll_progress)
+            return
 
         else:
-            progress_bar = self.progress_use
-            progress_label = self.progress_label_use
-
-            # Load scraped data directly
-            data_list = []
-            for i, data in enumerate(self.load_data()):
-                time.sleep(0.5)
-                data_list.append(data)
-                progress_value = (i + 1) * 50
-                progress_bar['value'] = progress_value
-                progress_label['text'] = f"{progress_value}%"
+            # Load scraped data directly, the progress bar follows the recorded stage events
+            def show_load_progress(event):
+                self.show_progress(self.progress_use, self.progress_label_use, event)
                 self.root.update_idletasks()
-            self.df, self.df_weather = data_list
-            self.df['Ranking'] = self.df.apply(lambda x: str(x['Ranking']), axis=1)
+
+            with start_run("load", total=2, listener=show_load_progress) as run:
+                self.df, self.df_weather = self.load_data(run)
+            self.df['Ranking'] = self.df['Ranking'].astype(str)
+            self.index = ProgramIndex(self.df)
+            self.ranker = RankingEngine(self.df)
+            self.data_version = dataset_version(self.df)
+            self.weather_by_university = self.build_weather_lookup(self.df_weather)
 
         # 加载完毕后，允许用户点击CONTINUE按钮
         self.btn_continue.config(state=tk.NORMAL)
 
+    def run_refresh(self, full_refresh):
+        """
+        Run the refresh pipeline, called in a worker thread. Never touches Tk widgets directly.
+        :param full_refresh: rerun every stage instead of only the ones whose inputs changed
+        """
+        try:
+            df, df_weather, _ = refresh(force=full_refresh, progress=self.progress_queue.put)
+            self.progress_queue.put({"status": "complete", "data": (df, df_weather)})
+        except Exception as error:
+            self.progress_queue.put({"status": "error", "error": error})
+
+    def poll_progress(self):
+        """
+        Apply the progress events posted by the refresh worker to the progress bar.
+        """
+        while True:
+            try:
+                event = self.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if event["status"] == "complete":
+                self.df, self.df_weather = event["data"]
+                self.df['Ranking'] = self.df['Ranking'].astype(str)
+                self.index = ProgramIndex(self.df)
+                self.ranker = RankingEngine(self.df)
+                self.data_version = dataset_version(self.df)
+                self.weather_by_university = self.build_weather_lookup(self.df_weather)
+                self.progress_scrape['value'] = 100
+                self.progress_label_scrape['text'] = "100%"
+                self.btn_use.config(state=tk.NORMAL)
+                self.btn_scrape.config(state=tk.NORMAL)
+                # 加载完毕后，允许用户点击CONTINUE按钮
+                self.btn_continue.config(state=tk.NORMAL)
+                return
+            if event["status"] == "error":
+                self.progress_label_scrape['text'] = f"Failed: {event['error']}"
+                self.btn_use.config(state=tk.NORMAL)
+                self.btn_scrape.config(state=tk.NORMAL)
+                return
+
+            self.show_progress(self.progress_scrape, self.progress_label_scrape, event)
+
+        self.root.after(100, self.poll_progress)
+
+    @staticmethod
+    def show_progress(progress_bar, progress_label, event):
+        """
+        Show a stage event of the metrics run on a progress bar.
+        :param progress_bar: progress bar to update
+        :param progress_label: label next to the progress bar
+        :param event: event dict with keys stage, status, done and total
+        """
+        progress_value = event["done"] * 100 // event["total"]
+        progress_bar['value'] = progress_value
+        if event["status"] == "run_finished":
+            progress_label['text'] = f"{progress_value}%"
+        else:
+            progress_label['text'] = f"{progress_value}% ({event['stage']} {event['status']})"
+
     def goto_canvas1(self):
         self.canvas2.pack_forget()
         self.canvas1.pack(fill="both", expand=True)
@@ -204,14 +302,23 @@ class CompassApp:
             else:
                 print(f"{directory} does not exist!")
 
-    @staticmethod
-    def load_data():
+    def load_data(self, run):
         """Load data such as school ranking, safety, climate,...,etc.
+        Only the columns shown in the GUI are read from the columnar copy when it exists.
+        :param run: metrics run recording the two loads
+        :return: merged program data, monthly weather data per university
         """
+        columns = list(dict.fromkeys(self.labels + [col for cols in self.columns_display for col in cols]
+                                     + list(RANKING_FEATURES) + list(SIMILARITY_FEATURES)))
         # Load data for filter
-        yield pd.read_csv(os.path.join("merge_previous", "merged.csv"))
+        with run.stage("load_merged") as metrics:
+            df = read_table(os.path.join("merge_previous", "merged.csv"), columns=columns)
+            metrics["rows_out"] = len(df)
         # Load data to plot chart
-        yield pd.read_csv(os.path.join("merge_previous", "weather_merged.csv"))
+        with run.stage("load_weather_merged") as metrics:
+            df_weather = read_table(os.path.join("merge_previous", "weather_merged.csv"))
+            metrics["rows_out"] = len(df_weather)
+        return df, df_weather
 
 
     def create_comboboxes(self):
@@ -243,64 +350,106 @@ class CompassApp:
     def view_data(self):
         """ Filter program based on the selection in the drop-down box
         """
-        mask = [True] * len(self.df)
-        for label, var in self.combobox_vars.items():
-            if label == "Plot": continue
-
-            value = var.get()
-            if value:
-                if value == "All":
-                    continue
-                if label == "Ranking":
-                    value = int(value.strip("Top"))
-                    mask &= (self.df[label].isin([str(i + 1) for i in range(int(value))]))
-                elif label == "Points":
-                    lower_bound = int(value.split("-")[0])
-                    upper_bound = int(value.split("-")[1])
-                    mask &= (self.df[label].isin([i for i in range(lower_bound, upper_bound + 1)]))
-                else:
-                    mask &= (self.df[label] == value)
-        result = self.df[mask]
+        selections = {label: var.get() for label, var in self.combobox_vars.items() if label != "Plot"}
+        result = self.df[self.index.query(selections)]
 
         # Update the content in text box
         self.update_display(result)
 
+    def rank_programs(self):
+        """ Rank the programs matching the filters by the weights of the sliders, best first
+        """
+        selections = {label: var.get() for label, var in self.combobox_vars.items() if label != "Plot"}
+        weights = {feature: var.get() for feature, var in self.weight_vars.items()}
+        if not any(weights.values()):
+            self.error_message.config(text="Please set at least one weight")
+            return
+        self.error_message.config(text="")
+        best = self.ranker.top_k(weights, k=RANK_SIZE, mask=self.index.query(selections))[0]
+
+        # Update the content in text box
+        self.update_display(self.df.iloc[best])
+
+    def show_similar(self):
+        """ List the programs closest to the selected university, among those matching the other filters
+        """
+        university = self.combobox_vars['University'].get()
+        if university in ("", "All"):
+            self.error_message.config(text="Please select an University")
+            return
+        self.error_message.config(text="")
+        selections = {label: var.get() for label, var in self.combobox_vars.items() if label != "Plot"}
+        selections['University'] = "All"
+        # The index is only rebuilt when the data is refreshed
+        index = similarity_index(self.df, self.data_version)
+        try:
+            rows = index.similar(university, k=SIMILAR_SIZE, mask=self.index.query(selections))
+        except KeyError:
+            # The combobox is editable, the typed name may not be in the data
+            self.error_message.config(text="Unknown university: {}".format(university))
+            return
+
+        # Update the content in text box
+        self.update_display(self.df.iloc[rows])
+
     def update_display(self, data):
+        """
+        Show the filtered programs. Only the first page is formatted and inserted,
+        the next pages are added when the text box is scrolled near its end.
+        :param data: filtered programs
+        """
         # Clear the current data
         self.text.delete(1.0, tk.END)
-        # Add data
+        self.result_data = data
+        self.rendered_count = 0
+        self.render_next_page()
+
+    def render_next_page(self):
+        """
+        Format the next page of result blocks in bulk and insert it with a single Tk call.
+        """
+        if self.result_data is None or self.rendered_count >= len(self.result_data):
+            return
+        page = self.result_data.iloc[self.rendered_count:self.rendered_count + PAGE_SIZE]
+        self.rendered_count += len(page)
+        self.text.insert(tk.END, "".join(self.format_blocks(page)))
+
+    def on_text_scroll(self, first, last):
+        """
+        Fetch the next page once the visible part of the text box reaches its end.
+        """
+        if float(last) >= 0.9:
+            self.render_next_page()
+
+    def format_blocks(self, data):
+        """
+        Format one text block per program from whole columns instead of row by row.
+        :param data: programs to format
+        :return: list of text blocks
+        """
+        columns = {col: data[col].tolist() for cols in self.columns_display for col in cols}
+        blocks = []
         for i in range(len(data)):
-            df_row = data.iloc[[i], :]
-
-            for j, columns in enumerate(self.columns_display):
-                if j == 0 or j == 5:
-                    for _, row in df_row[columns].iterrows():
-                        for col, value in row.items():
-                            self.text.insert(tk.END, f"{col}: {value}\n")
-                elif j == 1:
-                    in_state_tuition, out_state_tuition = df_row[columns].values.tolist()[0]
-
-                    self.text.insert(tk.END, f"Tuition: "
-                                             f"in state tuition is ${int(in_state_tuition)}, "
-                                             f"out state tuition is ${int(out_state_tuition)}\n")
-                elif j == 2:
-                    pop_category, pop_2022 = df_row[columns].values.tolist()[0]
-                    self.text.insert(tk.END, f"Population: "
-                                             f"relatively {pop_category} size, "
-                                             f"number estimated in 2022 is {int(pop_2022)}\n")
-                elif j == 3:
-                    safety_category, total_criminal_count = df_row[columns].values.tolist()[0]
-                    self.text.insert(tk.END, f"Safety: "
-                                             f"relatively {safety_category} risk of danger, "
-                                             f"total criminal count in 2021 is {int(total_criminal_count)}\n")
-                elif j == 4:
-                    temperates = df_row[columns].values.tolist()[0]
-                    temperates = [round(v, 2) if i >= 1 else v for i, v in enumerate(temperates)]
-                    self.text.insert(tk.END, "Temperature: {}, "
-                                             "average value in 2022: spring is {}°C, summer is {}°C, "
-                                             "fall is {}°C, winter is {}°C\n".format(*temperates))
-
-            self.text.insert(tk.END, "\n")
+            lines = [f"{col}: {columns[col][i]}\n" for col in self.columns_display[0]]
+            lines.append(f"Tuition: "
+                         f"in state tuition is ${int(columns['In_State_Tuition'][i])}, "
+                         f"out state tuition is ${int(columns['Out_of_State_Tuition'][i])}\n")
+            lines.append(f"Population: "
+                         f"relatively {columns['population_category'][i]} size, "
+                         f"number estimated in 2022 is {int(columns['Population_estimate_2022'][i])}\n")
+            lines.append(f"Safety: "
+                         f"relatively {columns['safety_category'][i]} risk of danger, "
+                         f"total criminal count in 2021 is {int(columns['Total_criminal_count'][i])}\n")
+            temperates = [columns[col][i] for col in self.columns_display[4]]
+            temperates = [round(v, 2) if j >= 1 else v for j, v in enumerate(temperates)]
+            lines.append("Temperature: {}, "
+                         "average value in 2022: spring is {}°C, summer is {}°C, "
+                         "fall is {}°C, winter is {}°C\n".format(*temperates))
+            lines.extend(f"{col}: {columns[col][i]}\n" for col in self.columns_display[5])
+            lines.append("\n")
+            blocks.append("".join(lines))
+
+        return blocks
 
     def reset(self):
         """
@@ -329,26 +478,65 @@ class CompassApp:
         elif university and university != "All":
             # Delete the error message
             self.error_message.config(text="")
-            # Filter the data to the university of choice
-            weather_processed_df = self.df_weather[self.df_weather["University"] == university]
-            months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-
-            fig = plt.figure(figsize=(7, 4))
-            plt.scatter(x=months, y=weather_processed_df['Temperature_avg'])
-            title = "Average Temperature in " + university
-            plt.title(title)
-            plt.xlabel("Month")
-            plt.ylabel("Avg Temperature (C)")
-
-            self.canvas3 = FigureCanvasTkAgg(fig, master=self.canvas2)
-            canvas_widget = self.canvas3.get_tk_widget()
-            canvas_widget.grid(row=6, column=0, columnspan=30, padx=10, pady=10)
-            self.canvas3.draw()
+            # Look up the monthly temperatures of the university of choice
+            months, temperatures = self.weather_by_university.get(university, (np.array([]), np.array([])))
+
+            # The figure and its Tk canvas are created once, later plots only replace the points
+            if self.canvas3 is None:
+                self.scatter_figure = Figure(figsize=(7, 4))
+                self.scatter_axes = self.scatter_figure.add_subplot()
+                self.scatter_points = self.scatter_axes.scatter([], [])
+                self.scatter_axes.set_xticks(range(1, 13), MONTH_NAMES)
+                self.scatter_axes.set_xlabel("Month")
+                self.scatter_axes.set_ylabel("Avg Temperature (C)")
+
+                self.canvas3 = FigureCanvasTkAgg(self.scatter_figure, master=self.canvas2)
+                canvas_widget = self.canvas3.get_tk_widget()
+                canvas_widget.grid(row=6, column=0, columnspan=30, padx=10, pady=10)
+
+            self.scatter_points.set_offsets(np.column_stack([months, temperatures]))
+            self.scatter_axes.ignore_existing_data_limits = True
+            self.scatter_axes.update_datalim(np.column_stack([months, temperatures]) if len(months) else [[1, 0]])
+            self.scatter_axes.autoscale_view()
+            self.scatter_axes.set_title("Average Temperature in " + university)
+            self.canvas3.draw_idle()
+
+    @staticmethod
+    def build_weather_lookup(df_weather):
+        """
+        Precompute the monthly average temperatures of every university for the scatter chart.
+        :param df_weather: monthly weather data per university
+        :return: dict of university to (months, average temperatures), sorted by month
+        """
+        lookup = {}
+        df_weather = df_weather.sort_values("Month", kind="stable")
+        for university, group in df_weather.groupby("University", sort=False, observed=True):
+            lookup[university] = (group["Month"].to_numpy(), group["Temperature_avg"].to_numpy())
+        return lookup
 
     def plot_map(self):
-        map_plot(self.df)
+        """
+        Draw the map of program counts per state for the programs matching the current filters.
+        The rendered map is cached per dataset version and filter, so showing it again is instant.
+        """
+        selections = {label: var.get() for label, var in self.combobox_vars.items() if label != "Plot"}
+        filter_key = json.dumps(selections, sort_keys=True)
+        mask = self.index.query(selections)
+
+        if HAS_KALEIDO:
+            # Show the map inside the window
+            path = render_map(self.df, mask, filter_key, version=self.data_version, image=True)
+            self.map_image = tk.PhotoImage(file=path)
+            if self.map_label is None:
+                self.map_label = tk.Label(self.canvas2)
+                self.map_label.grid(row=7, column=0, columnspan=30, padx=10, pady=10)
+            self.map_label.config(image=self.map_image)
+        else:
+            path = render_map(self.df, mask, filter_key, version=self.data_version)
+            webbrowser.open("file://" + os.path.abspath(path))
 
 
-root = tk.Tk()
-app = CompassApp(root)
-root.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    root = tk.Tk()
+    app = CompassApp(root)
+    root.mainloop()
\ No newline at end of file
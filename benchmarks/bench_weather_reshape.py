@@ -0,0 +1,98 @@
+"""
+@File name: bench_weather_reshape
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: compare the vectorized NCEI reshape against the original day-by-day loop
+on synthetic monthly files, and check that both write the same csv bytes.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import data_collection as dc
+from fixtures import make_ncei_month, write_ncei_mirror
+
+
+def legacy_weather_month(df_weather_month, month, type_):
+    """
+    The original day-by-day reshape of collect_and_clean_weather, kept as the baseline.
+    """
+    columns = ["Region_type", "County_code", "County", "Year", "Month", "Temper_type"]
+    day_list = ["2022-{}-{}".format(month, day) for day in dc.WEATHER_DAYS]
+    df_weather_month = df_weather_month.copy()
+    df_weather_month.columns = columns + day_list
+    temper_column = dc.TEMPER_TYPE_MAP[type_]
+
+    df_merge_month = pd.DataFrame()
+    for day in day_list:
+        df_day = df_weather_month[columns + [day]]
+        df_day["Date"] = day
+        df_day = df_day[["Date", "County", day]]
+        df_day.rename(columns={day: temper_column}, inplace=True)
+        df_day.query("{} > -999.99".format(temper_column), inplace=True)
+
+        states = []
+        counties = []
+        for value in df_day["County"].tolist():
+            state, county = value.strip().split(":")
+            states.append(state)
+            counties.append(county)
+        df_day["County"] = counties
+        df_day["State"] = states
+
+        df_merge_month = pd.concat([df_merge_month, df_day])
+        df_merge_month.drop_duplicates(subset=["Date", "State", "County"], inplace=True)
+
+    return df_merge_month
+
+
+def run(reshape, raw_months):
+    """
+    Reshape and join every synthetic month and return the csv the collector would write.
+    """
+    start = time.perf_counter()
+    df_weather_months = []
+    for month, raw_types in raw_months.items():
+        frames = [reshape(raw, month, type_) for type_, raw in raw_types.items()]
+        df_weather_months.append(dc.merge_weather_month(frames))
+    df_weather = pd.concat(df_weather_months)
+    elapsed = time.perf_counter() - start
+
+    csv = (df_weather[["Date", "State", "County", "Temperature_avg", "Temperature_max", "Temperature_min"]]
+           .to_csv(index=False))
+    return elapsed, csv
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--counties", type=int, default=3000, help="county rows per monthly file")
+    parser.add_argument("--months", type=int, default=12, help="number of months to generate")
+    parser.add_argument("--write-mirror", metavar="DIR",
+                        help="also write the 36 synthetic files into DIR and time the full collector on it")
+    args = parser.parse_args()
+
+    raw_months = {month: {type_: make_ncei_month(month, type_, args.counties) for type_ in dc.WEATHER_TYPES}
+                  for month in dc.WEATHER_MONTHS[:args.months]}
+
+    legacy_time, legacy_csv = run(legacy_weather_month, raw_months)
+    vector_time, vector_csv = run(dc.reshape_weather_month, raw_months)
+
+    print("counties per file: {}, months: {}".format(args.counties, args.months))
+    print("legacy loop:   {:8.3f}s".format(legacy_time))
+    print("vectorized:    {:8.3f}s".format(vector_time))
+    print("speedup:       {:8.1f}x".format(legacy_time / vector_time))
+    print("csv identical: {}".format(legacy_csv == vector_csv))
+
+    if args.write_mirror:
+        write_ncei_mirror(args.write_mirror, args.counties)
+        start = time.perf_counter()
+        dc.collect_and_clean_weather(mirror_dir=os.path.abspath(args.write_mirror))
+        print("collector on mirror: {:8.3f}s".format(time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
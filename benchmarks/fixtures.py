@@ -0,0 +1,218 @@
+"""
+@File name: fixtures
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: generate realistic synthetic inputs for every pipeline stage, offline and at any scale.
+"""
+
+import calendar
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import data_collection as dc
+from map_plot import STATE_ABBR
+
+STATE_NAMES = sorted(STATE_ABBR)
+CRIME_COLUMNS = ["Murder/Non-negligent manslaughter", "Rape", "Robbery", "Aggravated assault",
+                 "Burglary", "Motor vehicle theft"]
+
+
+def make_ncei_csv(month, type_, n_counties, seed=0):
+    """
+    Build the text of a synthetic NCEI-shaped monthly county file.
+    :param month: two-digit month
+    :param type_: temperature type, "tavg", "tmax" or "tmin"
+    :param n_counties: number of county rows
+    :param seed: random seed
+    :return: csv text without a header line, like the real files
+    """
+    rng = np.random.default_rng(seed + int(month) * 10 + dc.WEATHER_TYPES.index(type_))
+    n_days = calendar.monthrange(2022, int(month))[1]
+    values = np.round(rng.normal(12, 8, size=(n_counties, 31)), 2)
+    values[:, n_days:] = -999.99
+    df = pd.DataFrame(values)
+    df.insert(0, "type", type_.upper())
+    df.insert(0, "month", int(month))
+    df.insert(0, "year", 2022)
+    df.insert(0, "name", ["{}: County {}".format(STATE_ABBR[STATE_NAMES[i % len(STATE_NAMES)]], i)
+                          for i in range(n_counties)])
+    df.insert(0, "code", ["{:05d}".format(i) for i in range(n_counties)])
+    df.insert(0, "region", "cty")
+
+    return df.to_csv(index=False, header=False)
+
+
+def make_ncei_month(month, type_, n_counties, seed=0):
+    """
+    Build a synthetic monthly file and read it back the same way the collector does.
+    The real files have no header line, so the first county becomes the header.
+    """
+    return pd.read_csv(io.StringIO(make_ncei_csv(month, type_, n_counties, seed)))
+
+
+def write_ncei_mirror(directory, n_counties, seed=0):
+    """
+    Write all 36 synthetic monthly files into a local mirror directory.
+    :param directory: mirror directory, passed to collect_and_clean_weather(mirror_dir=...)
+    :param n_counties: number of county rows per file
+    :param seed: random seed
+    """
+    os.makedirs(directory, exist_ok=True)
+    for month in dc.WEATHER_MONTHS:
+        for type_ in dc.WEATHER_TYPES:
+            file_name = dc.WEATHER_FILE_TEMPLATE.format(type_, month)
+            with open(os.path.join(directory, file_name), "w") as fout:
+                fout.write(make_ncei_csv(month, type_, n_counties, seed))
+
+
+def city_names(n_cities):
+    return ["Place {}".format(i) for i in range(n_cities)]
+
+
+def write_census_file(path, n_rows, n_cities, seed=0):
+    """
+    Write a Census sub-est2022-shaped file, with state rows, county rows and place rows.
+    It holds the city names data_preprocess renames, so the merge runs unchanged.
+    :param path: path of the csv file, passed to collect_and_clean_pop(source=...)
+    :param n_rows: number of rows
+    :param n_cities: number of distinct city names
+    :param seed: random seed
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array([name + " city" for name in city_names(n_cities)] + ["Some town", "Old village"])
+    kind = rng.choice(["state", "county", "place"], n_rows, p=[0.02, 0.18, 0.8])
+    df = pd.DataFrame({
+        "SUMLEV": np.where(kind == "place", 162, np.where(kind == "county", 50, 40)),
+        "STATE": rng.integers(1, 57, n_rows),
+        "COUNTY": np.where(kind == "county", rng.integers(1, 300, n_rows), 0),
+        "PLACE": np.where(kind == "place", rng.integers(100, 99999, n_rows), 0),
+        "COUSUB": 0,
+        "CONCIT": 0,
+        "PRIMGEO_FLAG": 1,
+        "FUNCSTAT": "A",
+        "NAME": names[rng.integers(0, len(names), n_rows)],
+        "STNAME": np.array(STATE_NAMES)[rng.integers(0, len(STATE_NAMES), n_rows)],
+        "ESTIMATESBASE2020": rng.integers(100, 2 * 10 ** 6, n_rows)
+    })
+    for year in (2020, 2021, 2022):
+        df["POPESTIMATE{}".format(year)] = (df["ESTIMATESBASE2020"] * rng.uniform(0.95, 1.05, n_rows)).astype(int).astype("Int64")
+    # A place without a 2021 estimate, dropped by the collector
+    df.loc[3, ["SUMLEV", "COUNTY", "PLACE", "POPESTIMATE2021"]] = [162, 0, 99999, pd.NA]
+    df.loc[:2, ["NAME", "STNAME", "PLACE"]] = [["New York city", "New York", 51000],
+                                                ["Chapel Hill town", "North Carolina", 11800],
+                                                ["Chapel Hill town", "Tennessee", 13000]]
+    df.to_csv(path, index=False)
+
+
+def university_names(n_programs):
+    return ["University {}".format(i) for i in range(n_programs)]
+
+
+def write_safety_export(path, n_programs, campuses_per_university=2, seed=0):
+    """
+    Write a campus safety export-shaped csv, with several campuses per university.
+    :param path: path of the csv file
+    :param n_programs: number of universities
+    :param campuses_per_university: campuses of every university
+    :param seed: random seed
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = n_programs * campuses_per_university
+    df = pd.DataFrame({
+        "Survey year": 2021,
+        "Unitid": np.repeat(np.arange(100000, 100000 + n_programs), campuses_per_university),
+        "Institution name": np.repeat(university_names(n_programs), campuses_per_university),
+        "Campus ID": np.tile(np.arange(1, campuses_per_university + 1), n_programs),
+        "Campus Name": ["Campus {}".format(i) for i in range(n_rows)]
+    })
+    for column in CRIME_COLUMNS:
+        # The real export pads some column names with spaces
+        df[column + " "] = rng.poisson(3, n_rows)
+    df.to_csv(path, index=False)
+
+
+def make_program_catalog(n_programs, n_cities, seed=0):
+    """
+    Build a program catalog shaped like collect_and_clean_program's output. About half
+    of the programs are in a city of the Census fixture, the others need the state backfill.
+    :param n_programs: number of programs, 50 to 50k
+    :param n_cities: number of distinct city names of the Census fixture
+    :param seed: random seed
+    :return: DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    known_city = rng.random(n_programs) < 0.5
+    cities = np.where(known_city,
+                      np.array(city_names(n_cities))[rng.integers(0, n_cities, n_programs)],
+                      np.array(["Town {}".format(i) for i in range(n_programs)]))
+    return pd.DataFrame({
+        "University": university_names(n_programs),
+        "Degree": "Master of Science in Computer Science",
+        "Ranking": [str(i + 1) for i in range(n_programs)],
+        "Points": rng.integers(1, 60, n_programs),
+        "In_State_Tuition": rng.integers(10000, 60000, n_programs),
+        "Out_of_State_Tuition": [str(value) for value in rng.integers(10000, 70000, n_programs)],
+        "Description": "The program offers coursework in algorithms, systems and machine learning.",
+        "City": [" " + city for city in cities],
+        "State": np.array(STATE_NAMES)[rng.integers(0, len(STATE_NAMES), n_programs)]
+    })
+
+
+def make_weather_frame(n_counties, seed=0):
+    """
+    Build a daily county weather frame shaped like the one collect_and_clean_weather writes.
+    :param n_counties: number of counties
+    :param seed: random seed
+    :return: DataFrame in compact dtypes
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2022-01-01", "2022-12-31")
+    counties = np.array(["County {}".format(i) for i in range(n_counties)])
+    states = np.array([STATE_ABBR[STATE_NAMES[i % len(STATE_NAMES)]] for i in range(n_counties)])
+    temperature_avg = np.round(rng.normal(12, 8, len(dates) * n_counties), 2)
+    df = pd.DataFrame({
+        "Date": np.repeat(dates.strftime("%Y-%m-%d"), n_counties),
+        "County": np.tile(counties, len(dates)),
+        "Temperature_avg": temperature_avg,
+        "State": np.tile(states, len(dates)),
+        "Temperature_max": temperature_avg + 5,
+        "Temperature_min": temperature_avg - 5
+    })
+    return dc.compact_weather_frame(df)
+
+
+def write_merged_outputs(directory, n_programs, n_cities=2000, seed=0):
+    """
+    Write merged.csv and weather_merged.csv shaped like the pipeline outputs, without running
+    the pipeline, e.g. to serve them from query_service.
+    :param directory: output directory
+    :param n_programs: number of programs
+    :param n_cities: number of distinct city names
+    :param seed: random seed
+    """
+    rng = np.random.default_rng(seed)
+    df = make_program_catalog(n_programs, n_cities, seed)
+    df["City"] = df["City"].str.strip()
+    df["Population_estimate_2022"] = rng.integers(1000, 10 ** 7, n_programs)
+    df["Total_criminal_count"] = rng.poisson(20, n_programs)
+    df["Temperature_avg"] = np.round(rng.normal(12, 8, n_programs), 2)
+    for season in ["spring", "summer", "fall", "winter"]:
+        df["Temperature_avg_" + season] = np.round(df["Temperature_avg"] + rng.normal(0, 6, n_programs), 2)
+    for column, labels in [("population_category", ["small", "medium", "large"]),
+                           ("temperature_category", ["cold", "medium", "hot"]),
+                           ("safety_category", ["low", "medium", "high"])]:
+        df[column] = rng.choice(labels, n_programs, p=[0.3, 0.5, 0.2])
+
+    df_weather = pd.DataFrame({
+        "State": np.repeat(df["State"].to_numpy(), 12),
+        "University": np.repeat(df["University"].to_numpy(), 12),
+        "Month": np.tile(np.arange(1, 13), n_programs),
+        "Temperature_avg": np.round(rng.normal(12, 8, n_programs * 12), 2)
+    })
+    os.makedirs(directory, exist_ok=True)
+    df.to_csv(os.path.join(directory, "merged.csv"), index=False, encoding="utf-8-sig")
+    df_weather.to_csv(os.path.join(directory, "weather_merged.csv"), index=False, encoding="utf-8-sig")
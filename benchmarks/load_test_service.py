@@ -0,0 +1,185 @@
+"""
+@File name: load_test_service
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: hit query_service with many concurrent keep-alive clients and report throughput and tail latency.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote, urlencode
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, ".."))
+import fixtures
+
+
+def random_targets(n_programs, n_requests, rng):
+    """
+    Build a request mix: 70% filters, 20% program details and 10% monthly temperatures.
+    """
+    universities = fixtures.university_names(n_programs)
+    targets = []
+    for _ in range(n_requests):
+        kind = rng.random()
+        university = quote(universities[rng.integers(0, n_programs)])
+        if kind < 0.7:
+            params = {}
+            if rng.random() < 0.5:
+                params["State"] = fixtures.STATE_NAMES[rng.integers(0, len(fixtures.STATE_NAMES))]
+            if rng.random() < 0.5:
+                params["Ranking"] = "Top{}".format(rng.integers(1, 10) * 10)
+            if rng.random() < 0.3:
+                params["safety_category"] = ["low", "medium", "high"][rng.integers(0, 3)]
+            params["limit"] = 20
+            targets.append("/programs?" + urlencode(params))
+        elif kind < 0.9:
+            targets.append("/program?university=" + university)
+        else:
+            targets.append("/weather?university=" + university)
+    return targets
+
+
+async def client(host, port, targets, latencies, errors, until=None):
+    """
+    Send requests one after the other on a single keep-alive connection.
+    :param until: optional asyncio.Event, the targets are sent again and again until it is set
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            for target in targets:
+                await send(reader, writer, host, target, latencies, errors)
+            if until is None or until.is_set():
+                break
+    finally:
+        writer.close()
+
+
+async def send(reader, writer, host, target, latencies, errors):
+    """
+    Send one request and read its response, recording the latency.
+    """
+    start = time.perf_counter()
+    writer.write("GET {} HTTP/1.1\r\nHost: {}\r\n\r\n".format(target, host).encode("latin-1"))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    body = await reader.readexactly(length)
+    if latencies is not None:
+        latencies.append(time.perf_counter() - start)
+    if status != 200:
+        errors.append((target, status, body[:200]))
+    return body
+
+
+async def served_version(host, port):
+    """
+    Get the dataset version the service currently answers from.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        body = await send(reader, writer, host, "/health", None, [])
+    finally:
+        writer.close()
+    return json.loads(body)["version"]
+
+
+async def run_load(host, port, n_clients, targets_per_client, until=None):
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, targets, latencies, errors, until)
+                           for targets in targets_per_client])
+    return latencies, errors, time.perf_counter() - start
+
+
+def start_service(data_dir, poll_interval):
+    """
+    Start query_service in its own process, so the clients do not share its event loop.
+    :return: process, port
+    """
+    process = subprocess.Popen([sys.executable, "-u", os.path.join(BENCHMARK_DIR, "..", "query_service.py"),
+                                "--data-dir", data_dir, "--port", "0", "--poll-interval", str(poll_interval)],
+                               stdout=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        if line.startswith("Listening on"):
+            return process, int(line.rsplit(":", 1)[1])
+    raise RuntimeError("query_service exited before listening")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=200, help="concurrent connections")
+    parser.add_argument("--requests", type=int, default=50, help="requests per connection")
+    parser.add_argument("--programs", type=int, default=5000, help="programs of the synthetic dataset")
+    parser.add_argument("--reload", action="store_true",
+                        help="write a new dataset while the clients run, to measure latency through a hot reload; "
+                             "the clients keep running until the new dataset is served")
+    parser.add_argument("--reload-timeout", type=float, default=60,
+                        help="seconds to wait for the new dataset to be served")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data_dir = tempfile.mkdtemp(prefix="compass-service-")
+    fixtures.write_merged_outputs(data_dir, args.programs)
+    process, port = start_service(data_dir, poll_interval=0.5)
+    try:
+        targets = random_targets(args.programs, args.clients * args.requests, rng)
+        targets_per_client = [targets[i::args.clients] for i in range(args.clients)]
+
+        async def load():
+            reloaded = asyncio.Event() if args.reload else None
+            if args.reload:
+                version = await served_version("127.0.0.1", port)
+            task = asyncio.create_task(run_load("127.0.0.1", port, args.clients, targets_per_client, reloaded))
+            if args.reload:
+                await asyncio.sleep(0.2)
+                await asyncio.get_running_loop().run_in_executor(
+                    None, fixtures.write_merged_outputs, data_dir, args.programs, 2000, 1)
+                # Keep the clients busy until the new dataset is swapped in
+                deadline = time.perf_counter() + args.reload_timeout
+                while await served_version("127.0.0.1", port) == version and time.perf_counter() < deadline:
+                    await asyncio.sleep(0.1)
+                reloaded.set()
+            return await task
+
+        latencies, errors, seconds = asyncio.run(load())
+    finally:
+        process.terminate()
+        output = process.communicate()[0]
+
+    # The first dataset was announced before "Listening on", so only reloads are left in the output
+    reloads = output.count("Serving")
+    latencies = np.array(latencies) * 1000
+    print(json.dumps({
+        "clients": args.clients, "requests": len(latencies), "errors": len(errors),
+        "seconds": round(seconds, 3), "requests_per_second": round(len(latencies) / seconds, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "max_ms": round(float(latencies.max()), 2),
+        "reloads": reloads}, indent=1))
+    for target, status, body in errors[:5]:
+        print(status, target, body)
+    if args.reload and reloads == 0:
+        print("The new dataset was not served within {} seconds".format(args.reload_timeout))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+@File name: run_benchmarks
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: time every pipeline stage on synthetic inputs, report throughput and peak memory,
+and keep the results so runs can be compared over time.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, ".."))
+import data_collection as dc
+from create_scatterplot import prep_weather_data_for_scatterplot
+from data_cleaning_merge import data_preprocess, merge
+from http_cache import HttpCache
+from program_index import EQUALITY_COLUMNS, ProgramIndex
+import fixtures
+
+RESULTS_PATH = os.path.join(BENCHMARK_DIR, "results", "history.jsonl")
+
+
+def measure(stage, func, rows_in, scale):
+    """
+    Run one stage and record its wall time, throughput and peak traced memory.
+    :param stage: name of the stage
+    :param func: function running the stage, returns (result, rows_out)
+    :param rows_in: number of input rows, used for the throughput
+    :param scale: dict describing the size of the inputs
+    :return: result of func, benchmark record
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        result, rows_out = func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    record = {"stage": stage, "scale": scale, "seconds": round(seconds, 4),
+              "rows_in": rows_in, "rows_out": rows_out,
+              "rows_per_second": round(rows_in / seconds, 1) if seconds else None,
+              "peak_mb": round(peak / 2 ** 20, 2)}
+    print("{:<16} {:>9.3f}s {:>12} rows in {:>12.0f} rows/s {:>10.1f} MB peak".format(
+        stage, seconds, rows_in, record["rows_per_second"] or 0, record["peak_mb"]))
+    return result, record
+
+
+def random_selections(df, n_queries, seed=0):
+    """
+    Build random drop-down selections like a user clicking through the filters.
+    """
+    rng = np.random.default_rng(seed)
+    values = {column: df[column].dropna().astype(str).unique() for column in EQUALITY_COLUMNS}
+    queries = []
+    for _ in range(n_queries):
+        selections = {}
+        for column in EQUALITY_COLUMNS:
+            if rng.random() < 0.3:
+                selections[column] = rng.choice(values[column])
+        if rng.random() < 0.5:
+            selections["Ranking"] = "Top{}".format(rng.integers(1, 10) * 10)
+        if rng.random() < 0.5:
+            lower_bound = rng.integers(0, 6) * 10 + 1
+            selections["Points"] = "{}-{}".format(lower_bound, lower_bound + 9)
+        queries.append(selections)
+    return queries
+
+
+def run_collectors(args):
+    """
+    Benchmark the population, safety and weather collectors on local fixtures.
+    :return: collected frames and benchmark records
+    """
+    records = []
+    census_path = os.path.abspath("census_fixture.csv")
+    fixtures.write_census_file(census_path, args.census_rows, args.cities)
+    df_population, record = measure(
+        "population", lambda: (lambda df: (df, len(df)))(dc.collect_and_clean_pop(source=census_path)),
+        args.census_rows, {"census_rows": args.census_rows})
+    records.append(record)
+
+    # The safety export is served from a private cache, so the browser is never started
+    export_path = os.path.abspath("safety_fixture.csv")
+    fixtures.write_safety_export(export_path, max(args.programs))
+    dc.CACHE.store(dc.SAFETY_URL, export_path)
+    n_safety = max(args.programs) * 2
+    df_criminal, record = measure(
+        "safety", lambda: (lambda df: (df, len(df)))(dc.collect_and_clean_safety()),
+        n_safety, {"campuses": n_safety})
+    records.append(record)
+
+    mirror_dir = os.path.abspath("ncei_mirror")
+    fixtures.write_ncei_mirror(mirror_dir, args.counties)
+    df_weather, record = measure(
+        "weather", lambda: (lambda df: (df, len(df)))(dc.collect_and_clean_weather(mirror_dir=mirror_dir)),
+        args.counties * 36, {"counties": args.counties})
+    records.append(record)
+
+    return df_population, df_criminal, df_weather, records
+
+
+def run_downstream(args, n_programs, df_population, df_criminal, df_weather):
+    """
+    Benchmark the stages that depend on the program catalog for one catalog size.
+    :return: benchmark records
+    """
+    records = []
+    scale = {"programs": n_programs, "counties": args.counties, "census_rows": args.census_rows}
+    df_program = fixtures.make_program_catalog(n_programs, args.cities)
+
+    def inputs():
+        return df_population.copy(), df_criminal.copy(), df_weather.copy(), df_program.copy()
+
+    df_pop, df_crim, df_wea, df_prog = inputs()
+    _, record = measure("data_preprocess",
+                        lambda: (None, len(data_preprocess(df_pop, df_prog, df_wea, df_crim)[0])),
+                        len(df_wea) + n_programs, scale)
+    records.append(record)
+
+    df_pop, df_crim, df_wea, df_prog = inputs()
+    df_merged, record = measure("merge", lambda: (lambda df: (df, len(df)))(merge(df_pop, df_crim, df_wea, df_prog)),
+                                n_programs, scale)
+    records.append(record)
+
+    _, record = measure("scatter_prep", lambda: (lambda df: (df, len(df)))(prep_weather_data_for_scatterplot()),
+                        len(df_weather), scale)
+    records.append(record)
+
+    # What CompassApp.view_data does per click: build the index once, then one query per click
+    df_merged["Ranking"] = df_merged["Ranking"].astype(str)
+    queries = random_selections(df_merged, args.queries)
+
+    def view_data():
+        index = ProgramIndex(df_merged)
+        matches = sum(len(df_merged[index.query(selections)]) for selections in queries)
+        return None, matches
+
+    _, record = measure("view_data", view_data, args.queries, scale)
+    records.append(record)
+    return records
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(records):
+    """
+    Append the records of this run to the result history.
+    """
+    run = {"run_id": datetime.datetime.now().isoformat(timespec="seconds"), "commit": git_commit()}
+    os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+    with open(RESULTS_PATH, "a", encoding="utf-8") as fout:
+        for record in records:
+            fout.write(json.dumps(dict(run, **record)) + "\n")
+
+
+def compare_with_history(records):
+    """
+    Print the change of every stage against the latest earlier run at the same scale.
+    """
+    if not os.path.exists(RESULTS_PATH):
+        return
+    with open(RESULTS_PATH, "r", encoding="utf-8") as fin:
+        history = [json.loads(line) for line in fin if line.strip()]
+
+    print("\nCompared with the previous run at the same scale:")
+    for record in records:
+        previous = [old for old in history if old["stage"] == record["stage"] and old["scale"] == record["scale"]]
+        if not previous:
+            print("{:<16} no earlier run".format(record["stage"]))
+            continue
+        old = previous[-1]
+        print("{:<16} {:>7.2f}x time {:>7.2f}x peak memory (vs {} {})".format(
+            record["stage"], record["seconds"] / old["seconds"] if old["seconds"] else float("nan"),
+            record["peak_mb"] / old["peak_mb"] if old["peak_mb"] else float("nan"),
+            old["run_id"], old["commit"] or ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--programs", type=int, nargs="+", default=[50, 5000],
+                        help="program catalog sizes, e.g. 50 500 5000 50000")
+    parser.add_argument("--counties", type=int, default=500, help="county rows per NCEI monthly file")
+    parser.add_argument("--census-rows", type=int, default=80000, help="rows of the Census file")
+    parser.add_argument("--cities", type=int, default=20000, help="distinct city names")
+    parser.add_argument("--queries", type=int, default=1000, help="filter clicks for view_data")
+    parser.add_argument("--no-save", action="store_true", help="do not append the results to the history")
+    parser.add_argument("--compare", action="store_true", help="compare with the previous run at the same scale")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="compass-bench-")
+    cache = dc.CACHE
+    try:
+        # Stages write their outputs relative to the working directory
+        os.chdir(workdir)
+        dc.CACHE = HttpCache(os.path.join(workdir, "cache", "http"))
+
+        df_population, df_criminal, df_weather, records = run_collectors(args)
+        for n_programs in args.programs:
+            print("-- {} programs".format(n_programs))
+            records += run_downstream(args, n_programs, df_population, df_criminal, df_weather)
+    finally:
+        dc.CACHE = cache
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.compare:
+        compare_with_history(records)
+    if not args.no_save:
+        save_results(records)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,25 +10,26 @@ import os
 
 import pandas as pd
 import matplotlib.pyplot as plt
+from data_collection import WEATHER_MONTH_OUTPUT, load_weather_cube
+from data_store import read_table, write_table
+from instrumentation import instrumented, record_source
 
 
 # Import datasets
 def read_in_data_files():
-    df_weather = pd.read_csv('weather/temperature_county_2022.csv')
-    df_merged = pd.read_csv('merge/merged.csv')
+    # State by month temperatures aggregated by collect_and_clean_weather
+    df_weather = load_weather_cube(WEATHER_MONTH_OUTPUT)
+    df_merged = read_table(os.path.join('merge', 'merged.csv'), columns=['State', 'University'])
+    record_source('scatter', rows_read=len(df_weather) + len(df_merged))
     
     return df_weather, df_merged
 
 
 # Clean data (desired data is at the monthly and state level)
+@instrumented('scatter')
 def prep_weather_data_for_scatterplot():
     df_weather, df_merged = read_in_data_files()
 
-    # create month variable
-    df_weather['Month'] = pd.DatetimeIndex(df_weather['Date']).month
-    df_weather = df_weather.groupby(['State', 'Month']).agg(
-        {'Temperature_avg': 'mean', 'Temperature_min': 'min', 'Temperature_max': 'max'}).reset_index()
-    
     # change States from Abbreviations to actualy state names
     states = {
         'AK': 'Alaska',
@@ -85,15 +86,16 @@ def prep_weather_data_for_scatterplot():
     }
     
     # replace state abbreviations with full name
-    df_weather['State'] = df_weather['State'].replace(states)
+    df_weather['State'] = df_weather['State'].cat.rename_categories(lambda state: states.get(state, state))
     
     # merge weather data with final merged data to get university info + monthly temperatures
     weather_processed_df = pd.merge(df_weather, df_merged[["State", "University"]], on ='State',
                               how = 'inner')[['State', 'Month', 'Temperature_avg',
                                              'Temperature_min', 'Temperature_max', 'University']]
 
-    # output the final dataset
-    weather_processed_df.to_csv(os.path.join("merge", "weather_merged.csv"), index=False, encoding='utf-8-sig')
+    # output the final dataset, as csv and as a typed columnar copy for the GUI
+    write_table(weather_processed_df, os.path.join("merge", "weather_merged.csv"),
+                categoricals=['State', 'University'])
     return weather_processed_df
 
 
@@ -5,6 +5,9 @@
 """
 
 import data_collection as dc
+from data_store import write_table
+from instrumentation import instrumented
+import json
 import numpy as np
 import pandas as pd
 import os
@@ -13,6 +16,13 @@ warnings.filterwarnings("ignore")
 
 pd.set_option('display.max_rows', 1000)
 
+# category column: (source column, quantile thresholds, labels from lowest to highest)
+CATEGORY_RULES = {
+    'population_category': ('Population_estimate_2022', (0.3, 0.8), ('small', 'medium', 'large')),
+    'temperature_category': ('Temperature_avg', (0.3, 0.8), ('cold', 'medium', 'hot')),
+    'safety_category': ('Total_criminal_count', (0.3, 0.8), ('low', 'medium', 'high'))
+}
+
 def data_input():
     df_population = dc.collect_and_clean_pop()
     df_criminal = dc.collect_and_clean_safety()
@@ -21,6 +31,36 @@ def data_input():
 
     return df_population, df_criminal, df_weather, df_program
 
+def categorize_by_quantile(series, thresholds, labels):
+    """
+    Bin a whole column into categories, with cut points computed once from its quantiles.
+    A value gets the label of the highest cut point it is strictly above, and the first
+    label if it is not above any of them (missing values included).
+    :param series: numeric column to categorize
+    :param thresholds: increasing quantiles used as cut points, e.g. (0.3, 0.8)
+    :param labels: one label more than thresholds, from lowest to highest
+    :return: Series of labels, list of cut points
+    """
+    cuts = series.quantile(list(thresholds)).tolist()
+    values = series.to_numpy(dtype=float)
+    categories = np.full(len(values), labels[0], dtype=object)
+    for cut, label in zip(cuts, labels[1:]):
+        categories[values > cut] = label
+
+    return pd.Series(categories, index=series.index), cuts
+
+
+def add_category(df, category, category_rules, category_cuts):
+    """
+    Add a category column to df following its rule, and record the cut points used.
+    """
+    column, thresholds, labels = category_rules[category]
+    df[category], cuts = categorize_by_quantile(df[column], thresholds, labels)
+    category_cuts[category] = {'column': column, 'thresholds': list(thresholds),
+                               'labels': list(labels), 'cut_points': cuts}
+
+
+@instrumented('data_preprocess')
 def data_preprocess(df_population, df_program, df_weather, df_criminal):
     ''' df_program preprocess '''
     # remove extra spaces
@@ -100,19 +140,11 @@ def data_preprocess(df_population, df_program, df_weather, df_criminal):
         'WY': 'Wyoming'
     }
 
-    # create a mapping to turn date into season
-    season = {1: 'winter', 2: 'winter', 3: 'spring', 4: 'spring', 5: 'spring', 6: 'summer', 7: 'summer', 8: 'summer',
-              9: 'fall', 10: 'fall', 11: 'fall', 12: 'winter'}
-
-    # replace state initial with full name
-    df_weather['State'] = df_weather['State'].replace(states)
+    # replace state initial with full name, renaming the categories instead of every row
+    df_weather['State'] = df_weather['State'].astype('category').cat.rename_categories(
+        lambda state: states.get(state, state))
 
-    # add column season based on date
-    df_weather['Season'] = df_weather.apply(lambda x: season[int(x['Date'].split('-')[1])], axis=1)
-
-    # aggregate on season
-    df_weather = df_weather.groupby(['State', 'Season']).agg(
-        {'Temperature_avg': 'mean', 'Temperature_min': 'min', 'Temperature_max': 'max'}).reset_index()
+    # df_weather is already aggregated on state and season by collect_and_clean_weather
     # set up the new columns after aggregation
     columns = ['State']
     for i in ['Temperature_avg', 'Temperature_min', 'Temperature_max']:
@@ -142,60 +174,40 @@ def data_preprocess(df_population, df_program, df_weather, df_criminal):
     return df_program, df_population, df_weather, df_criminal
 
 
-def merge(df_population, df_criminal, df_weather, df_program):
+@instrumented('merge')
+def merge(df_population, df_criminal, df_weather, df_program, category_rules=CATEGORY_RULES):
     '''merge df_program and df_population'''
     df_program, df_population, df_weather, df_criminal = data_preprocess(df_population, df_program, df_weather,
                                                                          df_criminal)
 
     df_program_population = pd.merge(df_program, df_population, on=['State', 'City'], how='left')
 
-    # build a dictionary, key is state, value is the average population of every cities in that state
+    # average population of every cities in each state,
     # used to substitute null values if there is match in the population scraped data
-    state_pop = df_population.groupby('State').agg(
-        {'Population_estimate_2020': 'mean', 'Population_estimate_2021': 'mean',
-         'Population_estimate_2022': 'mean'}).reset_index()
-
-    state_pop_dict = {}
-    for index, row in state_pop.iterrows():
-        key = row['State']
-        values = [round(row['Population_estimate_2020'], 0), round(row['Population_estimate_2021'], 0),
-                  round(row['Population_estimate_2022'], 0)]
-        state_pop_dict[key] = values
-
-    # Fill in the null values
-    for index in df_program_population.index:
-        if pd.isna(df_program_population.loc[index, 'Population_estimate_2020']):
-            state = df_program_population.loc[index, 'State']
-            if str(state) == "nan":
-                print(state)
-            df_program_population.loc[index, 'Population_estimate_2020'] = state_pop_dict[state][0]
-            df_program_population.loc[index, 'Population_estimate_2021'] = state_pop_dict[state][1]
-            df_program_population.loc[index, 'Population_estimate_2022'] = state_pop_dict[state][2]
+    pop_columns = ['Population_estimate_2020', 'Population_estimate_2021', 'Population_estimate_2022']
+    state_pop = df_population.groupby('State')[pop_columns].mean().round(0)
+
+    # Fill in the null values in one step, programs without a known State keep their null values
+    missing = df_program_population['Population_estimate_2020'].isna()
+    state_fill = state_pop.reindex(df_program_population['State']).set_axis(df_program_population.index)
+    df_program_population.loc[missing, pop_columns] = state_fill.loc[missing, pop_columns]
 
 
     # generate popualation category column using quantile
-    df_program_population['population_category'] = df_program_population.apply(
-                    lambda x: 'large' if x['Population_estimate_2022'] > df_program_population['Population_estimate_2022'].quantile(0.8)
-                    else ('medium' if x['Population_estimate_2022'] > df_program_population['Population_estimate_2022'].quantile(0.3)
-                    else 'small'), axis=1)
+    category_cuts = {}
+    add_category(df_program_population, 'population_category', category_rules, category_cuts)
 
 
     '''merge weather data into the result table'''
     df_program_population_weather = pd.merge(df_program_population, df_weather, on='State', how='left')
 
     # Calculate the average temperature of
-    df_program_population_weather['Temperature_avg'] = df_program_population_weather.apply(
-                    lambda x: np.mean([x['Temperature_avg_fall'],
-                                       x['Temperature_avg_summer'],
-                                       x['Temperature_avg_winter'],
-                                       x['Temperature_avg_spring']]),axis=1)
+    df_program_population_weather['Temperature_avg'] = df_program_population_weather[
+        ['Temperature_avg_fall', 'Temperature_avg_summer', 'Temperature_avg_winter',
+         'Temperature_avg_spring']].mean(axis=1, skipna=False)
 
     # generate weather category column using quantile
-    df_program_population_weather['temperature_category'] = df_program_population_weather.apply(
-                    lambda x: 'hot' if x['Temperature_avg'] > df_program_population_weather['Temperature_avg'].quantile(
-                        0.8)
-                    else ('medium' if x['Temperature_avg'] > df_program_population_weather['Temperature_avg'].quantile(0.3)
-                    else 'cold'), axis=1)
+    add_category(df_program_population_weather, 'temperature_category', category_rules, category_cuts)
 
 
     '''merge criminal data into the result table'''
@@ -209,16 +221,30 @@ def merge(df_population, df_criminal, df_weather, df_program):
                                         df_result['Motor_vehicle_theft_cases']
 
     # generate criminal category column using quantile
-    df_result['safety_category'] = df_result.apply(
-                    lambda x: 'high' if x['Total_criminal_count'] > df_result['Total_criminal_count'].quantile(0.8)
-                    else ('medium' if x['Total_criminal_count'] > df_result['Total_criminal_count'].quantile(0.3)
-                          else 'low'), axis=1)
+    add_category(df_result, 'safety_category', category_rules, category_cuts)
+    df_result.attrs['category_cuts'] = category_cuts
 
     if not os.path.exists(os.path.abspath("./merge")):
         os.makedirs(os.path.abspath("./merge"))
 
-    # output the final dataset
-    df_result.to_csv(os.path.join("./merge/", "merged.csv"), index=False, encoding='utf-8-sig')
+    # The scraped ranking and tuition are strings, store them as the numbers the csv reads back as,
+    # so the columnar copy has the same dtypes. Integers with missing values stay integers
+    for column in ['Ranking', 'In_State_Tuition', 'Out_of_State_Tuition']:
+        try:
+            values = pd.to_numeric(df_result[column])
+        except ValueError:
+            continue
+        if values.dtype.kind == 'f' and (values.dropna() % 1 == 0).all():
+            values = values.astype('Int64')
+        df_result[column] = values
+
+    # output the final dataset, as csv and as a typed columnar copy for the GUI
+    write_table(df_result, os.path.join("./merge/", "merged.csv"),
+                categoricals=['State'] + list(category_rules))
+
+    # keep the cut points of every category next to the dataset for auditing
+    with open(os.path.join("./merge/", "category_cuts.json"), "w", encoding="utf-8") as fout:
+        json.dump(category_cuts, fout, indent=4)
 
     return df_result
 
@@ -9,33 +9,151 @@ import time
 # -*- coding: utf-8 -*-
 
 import pandas as pd
+import io
 import os
 import re
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from urllib.request import urlopen
-from bs4 import BeautifulSoup
+import lxml.html
+from http_cache import HttpCache
+from instrumentation import instrumented, record_source
+from data_store import read_table, write_table
 import warnings
 warnings.filterwarnings("ignore")
 
+# Shared cache of upstream responses, set to None to always download
+CACHE = HttpCache("./cache/http")
+# How long each source is trusted before it is revalidated with the server, in seconds
+CACHE_TTL = {
+    "population": 7 * 24 * 3600,
+    "safety": 7 * 24 * 3600,
+    "weather": 24 * 3600,
+    "program": 24 * 3600
+}
+
+POPULATION_URL = "https://www2.census.gov/programs-surveys/popest/datasets/2020-2022/cities/totals/sub-est2022.csv"
+SAFETY_URL = "https://ope.ed.gov/campussafety/#/customdata/datafiltered"
+PROGRAM_URL = "https://www.computersciencedegreehub.com/masters-computer-science"
+# Url of an already exported safety csv, e.g. served by the replay stand-in, used instead of the browser
+SAFETY_EXPORT_URL = None
+
+WEATHER_BASE_URL = "https://www.ncei.noaa.gov/pub/data/daily-grids/v1-0-0/averages/2022/"
+WEATHER_FILE_TEMPLATE = "{}-2022{}-cty-scaled.csv"
+WEATHER_OUTPUT = os.path.join("weather", "temperature_county_2022.csv")
+WEATHER_MONTHS = ["{:02d}".format(i) for i in range(1, 13)]
+WEATHER_DAYS = ["{:02d}".format(i) for i in range(1, 32)]
+WEATHER_TYPES = ["tavg", "tmax", "tmin"]
+TEMPER_TYPE_MAP = {"tavg": "Temperature_avg", "tmax": "Temperature_max", "tmin": "Temperature_min"}
+# Temperatures aggregated per state, by month for the scatter chart and by season for the merge
+WEATHER_MONTH_OUTPUT = os.path.join("weather", "temperature_state_month_2022.csv")
+WEATHER_SEASON_OUTPUT = os.path.join("weather", "temperature_state_season_2022.csv")
+WEATHER_AGGREGATIONS = {"Temperature_avg": "mean", "Temperature_min": "min", "Temperature_max": "max"}
+SEASONS = {1: 'winter', 2: 'winter', 3: 'spring', 4: 'spring', 5: 'spring', 6: 'summer', 7: 'summer', 8: 'summer',
+           9: 'fall', 10: 'fall', 11: 'fall', 12: 'winter'}
+
+# To ensure that location was probably pulled using regular expression,
+# confirm state exits in list of states. When a description mentions several
+# states, the first one of this list is kept
+US_STATES = ['Alaska', 'Alabama', 'Arkansas', 'Arizona', 'California', 'Colorado',
+             'Connecticut', 'District of Columbia', 'Delaware', 'Florida', 'Georgia',
+             'Hawaii', 'Iowa', 'Idaho', 'Illinois', 'Indiana', 'Kansas', 'Kentucky',
+             'Louisiana', 'Massachusetts', 'Maryland', 'Maine', 'Michigan',
+             'Minnesota', 'Missouri', 'Mississippi', 'Montana', 'North Carolina',
+             'North Dakota', 'Nebraska', 'New Hampshire', 'New Jersey', 'New Mexico',
+             'Nevada', 'New York', 'Ohio', 'Oklahoma', 'Oregon',
+             'Pennsylvania', 'Rhode Island', 'South Carolina', 'South Dakota',
+             'Tennessee', 'Texas', 'Utah', 'Virginia', 'Vermont', 'Washington',
+             'Wisconsin', 'West Virginia', 'Wyoming']
+STATE_RANK = {state: rank for rank, state in enumerate(US_STATES)}
+
+
+def trie_pattern(words):
+    """
+    Build a regular expression matching any of the words, with the alternatives factored
+    into a prefix tree, e.g. "N(?:e(?:braska|...)|orth (?:Carolina|Dakota))", so the text
+    is scanned once and each position only tries the branches of its first characters.
+    :param words: words to match, none of them may be a prefix of another
+    :return: pattern string
+    """
+    tree = {}
+    for word in words:
+        node = tree
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def branch(node):
+        alternatives = [re.escape(char) + branch(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ""
+        if len(alternatives) == 1 and "" not in node:
+            return alternatives[0]
+        return "(?:{}){}".format("|".join(alternatives), "?" if "" in node else "")
+
+    return branch(tree)
+
+
+# All state names in one pattern. Matches do not overlap, so the states written inside
+# another state name, i.e. "Virginia" inside "West Virginia", are added from STATES_WITHIN.
+# No state name ends with the beginning of another one, so no other match can be hidden
+STATE_PATTERN = re.compile(trie_pattern(US_STATES))
+STATES_WITHIN = {state: [other for other in US_STATES if other != state and other in state] for state in US_STATES}
+# Both city and state can be composed of two words
+IN_CITY_STATE_PATTERN = re.compile(r'in ([^\d\W]+(?: [^\d\W]+)?), ([^\d\W]+(?: [^\d\W]+)?)')
+# Three-word cities like "New York City", "Salt Lake City"
+LOCATED_IN_PATTERN = re.compile(r'[L|l]ocated in ([^\d\W]+(?: [^\d\W]+)?(?: [^\d\W]+)?)[.|,]')
+LOCATED_COMMA_PATTERN = re.compile(r'located [^,]*, ([^\d\W]+)')
+CITY_OF_PATTERN = re.compile(r'in the city of ([^\d\W]+(?: [^\d\W]+)?)')
+
+
+def open_source(url, source):
+    """
+    Open an upstream url through the shared response cache.
+    :param url: url to download
+    :param source: name of the source, used to pick its time to live
+    :return: binary file object of the content
+    """
+    if CACHE is None:
+        response = urlopen(url)
+        record_source(source, bytes_downloaded=int(response.headers.get("Content-Length") or 0))
+        return response
+    return open(fetch_source(url, source), "rb")
 
-def collect_and_clean_pop():
+
+def fetch_source(url, source):
+    """
+    Get an upstream url through the shared response cache, counting the bytes downloaded.
+    :param url: url to download
+    :param source: name of the source, used to pick its time to live
+    :return: path of the cached content
+    """
+    downloaded_before = CACHE.downloaded.get(url, 0)
+    path = CACHE.fetch(url, CACHE_TTL[source])
+    record_source(source, bytes_downloaded=CACHE.downloaded.get(url, 0) - downloaded_before)
+    return path
+
+
+@instrumented("population")
+def collect_and_clean_pop(chunksize=20000, source=None):
     """
     Collect and clean population size of the city or town of 51 U.S.states
     for 2020-2022 from the Census Bureau data.
+    The file is streamed in chunks, only the needed columns are parsed with compact dtypes,
+    and each chunk is filtered and deduplicated before the next one is read.
+    :param chunksize: number of raw rows parsed at a time
+    :param source: optional local path of a Census-shaped file used instead of the Census url
     :return:
     """
     if not os.path.exists(os.path.abspath("./population")):
         os.makedirs(os.path.abspath("./population"))
 
-    link = "https://www2.census.gov/programs-surveys/popest/datasets/2020-2022/cities/totals/sub-est2022.csv"
-    df_pop = pd.read_csv(link)
-
-    # Filter the whole population data of the state
-    df_pop.query("COUNTY !=0 or PLACE !=0", inplace=True)
-
     # Rename the columns
     columns = ["STNAME", "NAME", "POPESTIMATE2020", "POPESTIMATE2021", "POPESTIMATE2022"]
     name_map = {
@@ -45,35 +163,101 @@ def collect_and_clean_pop():
         "POPESTIMATE2021": "Population_estimate_2021",
         "POPESTIMATE2022": "Population_estimate_2022"
     }
-    df_pop = df_pop[columns].rename(columns=name_map)
-
-    # Remove Null and duplicate values
-    df_pop.dropna(inplace=True)
-    df_pop.drop_duplicates(subset=["State", "City"], inplace=True)
+    # Estimates are nullable while parsing, a blank estimate is dropped with the other null values
+    dtypes = {"COUNTY": "int16", "PLACE": "int32", "STNAME": str, "NAME": str,
+              "POPESTIMATE2020": "Int32", "POPESTIMATE2021": "Int32", "POPESTIMATE2022": "Int32"}
+    estimate_columns = ["Population_estimate_2020", "Population_estimate_2021", "Population_estimate_2022"]
+
+    output_path = os.path.join("./population", "population_county_2022.csv")
+    chunks = []
+    seen = set()
+    with (open(source, "rb") if source else open_source(POPULATION_URL, "population")) as fin:
+        for chunk in pd.read_csv(fin, usecols=list(dtypes), dtype=dtypes, chunksize=chunksize):
+            record_source("population", rows_read=len(chunk))
+            # Filter the whole population data of the state
+            chunk = chunk[(chunk["COUNTY"] != 0) | (chunk["PLACE"] != 0)]
+            chunk = chunk[columns].rename(columns=name_map)
+
+            # Remove Null and duplicate values, also against the rows kept from previous chunks
+            chunk = chunk.dropna().astype({column: "int32" for column in estimate_columns})
+            chunk = chunk.drop_duplicates(subset=["State", "City"])
+            keys = chunk["State"] + "\x1f" + chunk["City"]
+            is_new = ~keys.isin(seen)
+            chunk = chunk[is_new]
+            seen.update(keys[is_new])
+
+            chunk.to_csv(output_path, index=False, mode="w" if not chunks else "a", header=not chunks)
+            chunks.append(chunk)
+
+    df_pop = pd.concat(chunks)
     print(df_pop.head())
     print("Population dataset size of all U.S. states: {}".format(df_pop.shape[0]))
-    df_pop.to_csv(os.path.join("./population", "population_county_2022.csv"), index=False)
 
     return df_pop
 
 
-def collect_and_clean_safety():
+def wait_for_download(directory, existing_files, timeout=120, stable_period=1.0, poll_interval=0.25):
     """
-    Collect and clean campus safety information from the U.S. Department of Educatio
-    , for all universities in 2021.
-    :return:
+    Wait until a new csv file is completely written to the download directory.
+    A file counts as complete when Chrome has no partial download left and the file
+    size did not change for stable_period seconds.
+    :param directory: download directory
+    :param existing_files: file names that were in the directory before the download started
+    :param timeout: seconds to wait before giving up
+    :param stable_period: seconds the file size must stay the same
+    :param poll_interval: seconds between two checks of the directory
+    :return: path of the downloaded csv file
     """
-    # Set the download path of csv file
-    chrome_options = webdriver.ChromeOptions()
+    deadline = time.time() + timeout
+    last_size = None
+    stable_since = None
+    while time.time() < deadline:
+        new_files = [file for file in os.listdir(directory) if file not in existing_files]
+        partial = [file for file in new_files if file.endswith((".crdownload", ".tmp", ".part"))]
+        csv_files = [file for file in new_files if file.endswith("csv")]
+
+        if csv_files and not partial:
+            path = os.path.join(directory, csv_files[0])
+            size = os.path.getsize(path)
+            if size > 0 and size == last_size:
+                if time.time() - stable_since >= stable_period:
+                    return path
+            else:
+                last_size = size
+                stable_since = time.time()
+        time.sleep(poll_interval)
 
-    if not os.path.exists(os.path.abspath("./download")):
-        os.makedirs(os.path.abspath("./download"))
+    raise TimeoutError("The campus safety export was not downloaded within {} seconds".format(timeout))
 
-    if not os.path.exists(os.path.abspath("./safety")):
-        os.makedirs(os.path.abspath("./safety"))
+
+def has_display():
+    """
+    Check whether a browser window can be shown: always on Windows and macOS, elsewhere
+    only when an X or Wayland display is set, e.g. not in a cron job or over ssh.
+    """
+    if sys.platform in ("win32", "darwin"):
+        return True
+    return bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+
+def download_safety_export(headless=None, timeout=120):
+    """
+    Drive Chrome through the campus safety site and download the 2021 criminal offenses export.
+    :param headless: run Chrome without a window, None to do so only when there is no display
+    :param timeout: seconds to wait for the export to finish downloading
+    :return: paths of the downloaded csv files
+    """
+    download_dir = os.path.abspath("./download")
+    if headless is None:
+        headless = not has_display()
+
+    # Set the download path of csv file
+    chrome_options = webdriver.ChromeOptions()
+    if headless:
+        chrome_options.add_argument("--headless=new")
 
     prefs = {
-        "download.default_directory": os.path.abspath("./download"),
+        "download.default_directory": download_dir,
         "download.prompt_for_download": False,
         "download.directory_upgrade": True,
         "safebrowsing.enabled": True
@@ -82,9 +266,12 @@ def collect_and_clean_safety():
 
     # Open Chrome
     driver = webdriver.Chrome(options=chrome_options)
+    if headless:
+        # Headless Chrome only saves downloads when it is allowed explicitly
+        driver.execute_cdp_cmd("Page.setDownloadBehavior", {"behavior": "allow", "downloadPath": download_dir})
 
     # Open the target website
-    driver.get("https://ope.ed.gov/campussafety/#/customdata/datafiltered")
+    driver.get(SAFETY_URL)
     wait = WebDriverWait(driver, 10)
 
     # Choose year in checkbox
@@ -96,21 +283,57 @@ def collect_and_clean_safety():
     driver.execute_script("arguments[0].scrollIntoView();", crime_checkbox)
     crime_checkbox.click()
 
-    # Click the download button
+    # Click the download button, and wait until the export is fully written
+    existing_files = set(os.listdir(download_dir))
     download_button = wait.until(EC.element_to_be_clickable((By.XPATH, '/html/body/div[1]/div[2]/div/div/div['
                                                                        '3]/button[3]')))
     download_button.click()
-    driver.implicitly_wait(20)
-    time.sleep(15)
+    try:
+        export_file = wait_for_download(download_dir, existing_files, timeout=timeout)
+    finally:
+        # Close the website
+        driver.quit()
 
-    # Close the website
-    driver.quit()
+    if CACHE is not None:
+        # Keep a copy in the cache, the download folder itself is removed by a full refresh
+        fd, tmp_path = tempfile.mkstemp()
+        os.close(fd)
+        shutil.copyfile(export_file, tmp_path)
+        CACHE.store(SAFETY_URL, tmp_path)
+
+    record_source("safety", bytes_downloaded=os.path.getsize(export_file))
+    return [export_file]
+
+
+@instrumented("safety")
+def collect_and_clean_safety(headless=None, timeout=120):
+    """
+    Collect and clean campus safety information from the U.S. Department of Educatio
+    , for all universities in 2021.
+    :param headless: run Chrome without a window, so the stage can run unattended; None to
+    do so only when there is no display
+    :param timeout: seconds to wait for the export to finish downloading
+    :return:
+    """
+    if not os.path.exists(os.path.abspath("./download")):
+        os.makedirs(os.path.abspath("./download"))
+
+    if not os.path.exists(os.path.abspath("./safety")):
+        os.makedirs(os.path.abspath("./safety"))
+
+    # The export is not a plain http download, so the cache stores the exported file itself
+    if SAFETY_EXPORT_URL:
+        with open_source(SAFETY_EXPORT_URL, "safety") as fin:
+            export_files = [io.BytesIO(fin.read())]
+    else:
+        cached_export = CACHE.lookup(SAFETY_URL, CACHE_TTL["safety"]) if CACHE is not None else None
+        export_files = [cached_export] if cached_export else download_safety_export(headless, timeout)
 
     # Read and clean data
     df_safety = pd.DataFrame()
-    for file in os.listdir("./download"):
-        if not file.endswith("csv"): continue
-        df = pd.read_csv(os.path.join("./download", file))
+    for file in export_files:
+        df = pd.read_csv(file)
+        record_source("safety", rows_read=len(df))
         df_safety = pd.concat([df_safety, df])
 
     # Remove unexpected left or right space in column name
@@ -138,90 +361,303 @@ def collect_and_clean_safety():
     return df_safety
 
 
-def collect_and_clean_weather():
+def reshape_weather_month(df_weather_month, month, type_):
+    """
+    Reshape one monthly NCEI county file from wide format (one column per day)
+    into long format with one row per county and day.
+    :param df_weather_month: raw monthly file as read from NCEI
+    :param month: two-digit month of the file, e.g. "01"
+    :param type_: temperature type of the file, "tavg", "tmax" or "tmin"
+    :return: DataFrame with columns Date, County, <temperature column>, State
+    """
+    columns = ["Region_type", "County_code", "County", "Year", "Month", "Temper_type"]
+    day_list = ["2022-{}-{}".format(month, day) for day in WEATHER_DAYS]
+    temper_column = TEMPER_TYPE_MAP[type_]
+    df_weather_month = df_weather_month.copy()
+    df_weather_month.columns = columns + day_list
+
+    # Split state and county once per county instead of once per day
+    state_county = df_weather_month["County"].str.strip().str.split(":", n=1, expand=True)
+    df_weather_month["State"] = state_county[0]
+    df_weather_month["County"] = state_county[1]
+
+    # Melt the day columns, rows come out day by day in file order
+    df_long = df_weather_month.melt(id_vars=["County", "State"], value_vars=day_list,
+                                    var_name="Date", value_name=temper_column)
+
+    # Remove nonexistent days such as February 30 are set to -999.99
+    df_long = df_long[df_long[temper_column] > -999.99]
+    df_long = df_long[["Date", "County", temper_column, "State"]]
+    df_long = df_long.drop_duplicates(subset=["Date", "State", "County"])
+
+    return df_long
+
+
+def merge_weather_month(frames):
+    """
+    Join the long-format tavg, tmax and tmin frames of one month.
+    :param frames: long-format frames in the order of WEATHER_TYPES
+    :return: DataFrame with one row per county and day and all three temperatures
+    """
+    df_merge_type = frames[0]
+    for df_merge_month in frames[1:]:
+        df_merge_type = pd.merge(df_merge_type, df_merge_month, on=["Date", "State", "County"])
+
+    return df_merge_type
+
+
+def fetch_weather_file(source, file_name):
+    """
+    Download one monthly NCEI file as raw bytes, from NCEI or from a local mirror.
+    :param source: base url of the NCEI directory, a url of a local stand-in server,
+    or a local directory holding the same file names
+    :param file_name: file name such as "tavg-202201-cty-scaled.csv"
+    :return: raw content of the file
+    """
+    location = os.path.join(source, file_name)
+    if re.match(r'https?://', source):
+        with open_source(location, "weather") as response:
+            return response.read()
+    with open(location, "rb") as fin:
+        return fin.read()
+
+
+@instrumented("weather")
+def collect_and_clean_weather(max_workers=6, mirror_dir=None):
     """
     Collect and clean weather data from the National Centers for Environmental Information(NCEI)
     , for all counties in 2022.
-    :return:
+    Files are downloaded by a pool of worker threads while the calling thread parses
+    and reshapes the files that have already arrived.
+    :param max_workers: number of files downloaded at the same time
+    :param mirror_dir: optional local directory or stand-in server url used instead of NCEI
+    :return: state by season temperatures, see build_weather_cubes
     """
     if not os.path.exists(os.path.abspath("./weather")):
         os.makedirs(os.path.abspath("./weather"))
 
-    base_dir = "https://www.ncei.noaa.gov/pub/data/daily-grids/v1-0-0/averages/2022/"
-    months = [str(i) if len(str(i)) == 2 else "0"+str(i) for i in range(1, 13)]
-    temperature_types = ["tavg", "tmax", "tmin"]
-    temper_type_map = {"tavg": "Temperature_avg", "tmax": "Temperature_max", "tmin": "Temperature_min"}
-    file_name_temp = "{}-2022{}-cty-scaled.csv"
-    days = [str(i) if len(str(i)) == 2 else "0"+str(i) for i in range(1, 32)]
+    source = mirror_dir if mirror_dir else WEATHER_BASE_URL
 
     # Scrape daily data of average, max, min temperature
-    df_weather = pd.DataFrame()
-    for month in months:
-        df_merge_type = pd.DataFrame()
-        for type_ in temperature_types:
-            columns = ["Region_type", "County_code", "County", "Year", "Month", "Temper_type"]
-            day_list = ["2022-{}-{}".format(month, day) for day in days]
-            file_name = file_name_temp.format(type_, month)
-            df_weather_month = pd.read_csv(os.path.join(base_dir, file_name))
-            df_weather_month.columns = columns + day_list
-
-            # Merge data together
-            df_merge_month = pd.DataFrame()
-            for day in day_list:
-                df_day = df_weather_month[columns+[day]]
-                df_day["Date"] = day
-                df_day = df_day[["Date", "County", day]]
-                # Remove nonexistent days such as February 30 are set to -999.99
-                df_day.rename(columns={day: temper_type_map[type_]}, inplace=True)
-                df_day.query("{} > -999.99".format(temper_type_map[type_]), inplace=True)
-
-                # Split state and county
-                states = []
-                counties = []
-                for value in df_day["County"].tolist():
-                    state, county = value.strip().split(":")
-                    states.append(state)
-                    counties.append(county)
-                df_day["County"] = counties
-                df_day["State"] = states
-
-                df_merge_month = pd.concat([df_merge_month, df_day])
-                df_merge_month.drop_duplicates(subset=["Date", "State", "County"], inplace=True)
-
-            if len(df_merge_type) == 0:
-                df_merge_type = df_merge_month
-            else:
-                df_merge_type = pd.merge(df_merge_type, df_merge_month, on=["Date", "State", "County"])
-
-        df_weather = pd.concat([df_weather, df_merge_type])
+    frames = {month: {} for month in WEATHER_MONTHS}
+    df_weather_months = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for month in WEATHER_MONTHS:
+            for type_ in WEATHER_TYPES:
+                file_name = WEATHER_FILE_TEMPLATE.format(type_, month)
+                futures[executor.submit(fetch_weather_file, source, file_name)] = (month, type_)
+
+        # Parse each file as soon as it arrives, and join a month once all its types are in
+        for future in as_completed(futures):
+            month, type_ = futures[future]
+            df_weather_month = pd.read_csv(io.BytesIO(future.result()))
+            record_source("weather", rows_read=len(df_weather_month))
+            frames[month][type_] = reshape_weather_month(df_weather_month, month, type_)
+            if len(frames[month]) == len(WEATHER_TYPES):
+                df_weather_months[month] = merge_weather_month([frames[month][t] for t in WEATHER_TYPES])
+                del frames[month]
+
+    df_weather = pd.concat([df_weather_months[month] for month in WEATHER_MONTHS])
+    memory_before = df_weather.memory_usage(deep=True).sum()
+    df_weather = compact_weather_frame(df_weather)
+    memory_after = df_weather.memory_usage(deep=True).sum()
 
     print(df_weather.tail())
     print("Weather data size in 2022: {}".format(df_weather.size))
-    (df_weather[["Date", "State", "County", "Temperature_avg", "Temperature_max", "Temperature_min"]]
-     .to_csv("./weather/temperature_county_2022.csv", index=False))
+    print("Weather frame memory: {:.1f} MB, {:.1f} MB before compaction ({:.0%} saved)".format(
+        memory_after / 2 ** 20, memory_before / 2 ** 20, 1 - memory_after / memory_before))
+    write_table(df_weather[["Date", "State", "County", "Temperature_avg", "Temperature_max", "Temperature_min"]],
+                WEATHER_OUTPUT, categoricals=["State", "County"], encoding="utf-8")
+
+    # The consumers only need the state aggregates, the daily file is kept for ad-hoc analysis
+    df_month, df_season = build_weather_cubes(df_weather)
+    write_table(df_month, WEATHER_MONTH_OUTPUT, categoricals=["State"], encoding="utf-8")
+    write_table(df_season, WEATHER_SEASON_OUTPUT, categoricals=["State"], encoding="utf-8")
+
+    return df_season
+
+
+def build_weather_cubes(df_weather):
+    """
+    Aggregate the daily county weather per state and month, and per state and season:
+    mean of the daily averages, lowest minimum and highest maximum.
+    Both are computed from the daily rows, so a season is not an average of monthly averages.
+    :param df_weather: daily county weather frame in compact dtypes
+    :return: DataFrame with State, Month and the temperatures, DataFrame with State, Season and the temperatures
+    """
+    months = df_weather["Date"].dt.month
+    df_month = df_weather.groupby([df_weather["State"], months.rename("Month")], observed=True) \
+        .agg(WEATHER_AGGREGATIONS).reset_index()
+    df_season = df_weather.groupby([df_weather["State"], months.map(SEASONS).rename("Season")], observed=True) \
+        .agg(WEATHER_AGGREGATIONS).reset_index()
+    return df_month, df_season
+
+
+def compact_weather_frame(df_weather):
+    """
+    Convert the daily county weather frame to compact dtypes: categorical State and County,
+    datetime Date and float32 temperatures.
+    :param df_weather: daily weather frame, with Date as "2022-mm-dd" strings or datetimes
+    :return: compact copy of the frame
+    """
+    df_weather = df_weather.copy()
+    df_weather["Date"] = pd.to_datetime(df_weather["Date"], format="%Y-%m-%d")
+    for column in ["State", "County"]:
+        df_weather[column] = df_weather[column].astype("category")
+    for column in TEMPER_TYPE_MAP.values():
+        df_weather[column] = df_weather[column].astype("float32")
 
     return df_weather
 
 
+def load_weather_cube(path):
+    """
+    Load a state aggregate written by collect_and_clean_weather, in the dtypes it was computed in.
+    The daily weather file is aggregated again when the aggregate is missing, e.g. written
+    before aggregates existed.
+    :param path: WEATHER_MONTH_OUTPUT or WEATHER_SEASON_OUTPUT
+    :return: DataFrame
+    """
+    if not os.path.exists(path):
+        df_month, df_season = build_weather_cubes(load_weather_frame())
+        write_table(df_month, WEATHER_MONTH_OUTPUT, categoricals=["State"], encoding="utf-8")
+        write_table(df_season, WEATHER_SEASON_OUTPUT, categoricals=["State"], encoding="utf-8")
+    dtypes = {"State": "category", "Temperature_avg": "float32", "Temperature_max": "float32",
+              "Temperature_min": "float32"}
+    return read_table(path, dtype=dtypes)
+
+
+def load_weather_frame(path=None):
+    """
+    Load the daily county weather written by collect_and_clean_weather, in compact dtypes.
+    :param path: path of the csv export, defaults to weather/temperature_county_2022.csv
+    :return: DataFrame
+    """
+    dtypes = {"State": "category", "County": "category", "Temperature_avg": "float32",
+              "Temperature_max": "float32", "Temperature_min": "float32"}
+    return read_table(path or WEATHER_OUTPUT, dtype=dtypes, parse_dates=["Date"])
+
+
+def parse_program_page(content):
+    """
+    Extract the texts the program listing is built from, in a single forward pass over the lxml tree.
+    The description of a heading is made of the p and ul elements that follow the h3 under
+    the same parent, up to the next h3. Every parent remembers the description of its latest
+    h3 child, so each element is visited once instead of walking all the following siblings
+    of every heading.
+    :param content: html of the page, bytes or str
+    :return: dict with the texts of the h3 headings, of the p elements holding "Points:" and
+    "Tuition:", and the description following every h3
+    """
+    if isinstance(content, bytes):
+        try:
+            content = content.decode("utf-8")
+        except UnicodeDecodeError:
+            content = content.decode("windows-1252", errors="replace")
+    root = lxml.html.document_fromstring(content)
+
+    headings = []
+    points_texts = []
+    tuition_texts = []
+    descriptions = []
+    open_heading = {}
+    for element in root.iter("h3", "p", "ul"):
+        parent = element.getparent()
+        text = element.text_content()
+        if element.tag == "h3":
+            headings.append(text)
+            open_heading[parent] = len(descriptions)
+            descriptions.append("")
+            continue
+
+        if element.tag == "p":
+            if "Points:" in text:
+                points_texts.append(text)
+            if "Tuition:" in text:
+                tuition_texts.append(text)
+
+        # Description and bullet points listing out coursework between two h3 headings
+        index = open_heading.get(parent)
+        if index is None:
+            continue
+        if element.tag == "p" and "Points" not in text:
+            descriptions[index] += text
+        if element.tag == "ul":
+            descriptions[index] += " " + text.strip().replace("\n", ",")
+
+    return {"headings": headings, "points": points_texts, "tuition": tuition_texts,
+            "descriptions": descriptions}
+
+
+def extract_location(text, university):
+    """
+    Find the city and state of a university in its description.
+    The rules are tried in order:
+    "in_city_state": the description says "in city, state" with a real state, the
+    first such phrase decides. Otherwise the state is the first of US_STATES named
+    anywhere in the text ("state_name") and the city comes from the university name,
+    e.g. "University of Illinois – Urbana-Champaign" ("university_name"), or from
+    "located in city." ("located_in"), "located ..., city" ("located_comma") or
+    "in the city of city" ("city_of").
+    :param text: description of the program
+    :param university: name of the university
+    :return: city, state and the rules that matched joined by "+", None when not found
+    """
+    match_location = IN_CITY_STATE_PATTERN.search(text)
+    if match_location and match_location.group(2) in STATE_RANK:
+        return match_location.group(1), match_location.group(2), "in_city_state"
+
+    # Please note that it's entirely possible that the description includes
+    # NO information on location. For example saying University of California
+    # implies the university is in California, without stating its location
+    rules = []
+    states = set(STATE_PATTERN.findall(text))
+    for found in list(states):
+        states.update(STATES_WITHIN[found])
+    state = min(states, key=STATE_RANK.get, default=None)
+    if state is not None:
+        rules.append("state_name")
+
+    city = None
+    if '–' in university:
+        city = university.split('–')[1].strip()
+        rules.append("university_name")
+    elif 'located' in text or 'Located' in text:
+        match = LOCATED_IN_PATTERN.search(text)
+        if match:
+            city = " " + match.group(1)
+            rules.append("located_in")
+        elif LOCATED_COMMA_PATTERN.search(text):
+            city = " " + LOCATED_COMMA_PATTERN.search(text).group(1)
+            rules.append("located_comma")
+        elif CITY_OF_PATTERN.search(text):
+            city = CITY_OF_PATTERN.search(text).group(1)
+            rules.append("city_of")
+
+    return city, state, "+".join(rules) if rules else None
+
+
+@instrumented("program")
 def collect_and_clean_program():
     """
     Collect and clean program data from computer science degree hub.
     , for the latest data.
     :return:
     """
-    html = urlopen('https://www.computersciencedegreehub.com/masters-computer-science')
-
-    bsyc = BeautifulSoup(html.read(), "lxml")
+    with open_source(PROGRAM_URL, "program") as html:
+        content = html.read()
 
-    fout = open('bsyc_temp.txt', 'wt', encoding='utf-8')
-    fout.write(str(bsyc))
+    fout = open('bsyc_temp.txt', 'wb')
+    fout.write(content)
     fout.close()
 
-    data_list = bsyc.findAll('h3')
+    page = parse_program_page(content)
+    data_list = page["headings"]
+    record_source("program", rows_read=len(data_list))
     data = []
     unparsed = []
-    for d in data_list:
-        degree_name = d.text
+    for degree_name in data_list:
         unwanted_texts = ['Rankings', 'Infographics', 'Site Info']
         if degree_name in unwanted_texts:
             continue  # Skip this iteration and move to the next item
@@ -255,14 +691,10 @@ def collect_and_clean_program():
     bottom_df = df1.iloc[12:].copy()
     df = pd.concat([top_df, df5, bottom_df], ignore_index=True)
 
-    p_elements = bsyc.find_all('p')
-
     uni_data = []
-    for p in p_elements:
-        text = p.get_text()  # Get text content of the <p> element
-        if "Points:" in text:
-            points = text.split("Points:")[1].split("2020")[0].strip()
-            uni_data.append(points)  # Append points to uni_data
+    for text in page["points"]:
+        points = text.split("Points:")[1].split("2020")[0].strip()
+        uni_data.append(points)  # Append points to uni_data
 
     uni_data = ['20' if x == '' else x for x in uni_data]
     uni_data = [int(x) for x in uni_data]
@@ -272,32 +704,28 @@ def collect_and_clean_program():
     df['Points'] = df6
 
     tuition_data = []
-    for p in p_elements:
-        text = p.get_text()
-        if "Tuition:" in text:
-            # Extract and clean data
-            tuition = text.split("Tuition:")[1].split()[0].strip()  # get the tuition value
-            tuition = tuition.replace('$', '').replace(',', '')  # remove dollar sign and commas
-            tuition = float(tuition)
-            tuition_data.append(tuition)
+    for text in page["tuition"]:
+        # Extract and clean data
+        tuition = text.split("Tuition:")[1].split()[0].strip()  # get the tuition value
+        tuition = tuition.replace('$', '').replace(',', '')  # remove dollar sign and commas
+        tuition = float(tuition)
+        tuition_data.append(tuition)
 
     df7 = pd.DataFrame(tuition_data, columns=['Tuition'])
 
     out_of_state_tuition_data = []
-    for p in p_elements:
-        text = p.get_text()
-        if "Tuition:" in text:
-            # Check if out-of-state tuition is provided
-            if '(out of state)' in text:
-                out_of_state_tuition = text.split('(out of state)')[0].split('$')[
-                    -1]  # get the part before 'out of state)' and after the last '$'
-            else:
-                out_of_state_tuition = text.split('Tuition:')[1].split()[
-                    0].strip()  # if no out-of-state tuition provided, use the regular tuition
+    for text in page["tuition"]:
+        # Check if out-of-state tuition is provided
+        if '(out of state)' in text:
+            out_of_state_tuition = text.split('(out of state)')[0].split('$')[
+                -1]  # get the part before 'out of state)' and after the last '$'
+        else:
+            out_of_state_tuition = text.split('Tuition:')[1].split()[
+                0].strip()  # if no out-of-state tuition provided, use the regular tuition
 
-            # Remove commas only and keep the tuition as string
-            out_of_state_tuition = out_of_state_tuition.replace(',', '').strip()
-            out_of_state_tuition_data.append(out_of_state_tuition)
+        # Remove commas only and keep the tuition as string
+        out_of_state_tuition = out_of_state_tuition.replace(',', '').strip()
+        out_of_state_tuition_data.append(out_of_state_tuition)
 
     # Convert list to DataFrame
     df_out_of_state = pd.DataFrame(out_of_state_tuition_data, columns=['Out_of_State_Tuition'])
@@ -311,37 +739,12 @@ def collect_and_clean_program():
 
     # We would like to get the information between two <h3> tags including
     # the description and the bullet points listing out coursework
-    descriptions = []
-    for heading in bsyc.select('h3'):
-        vals = ''
-        for ns in (heading.fetchNextSiblings()):
-            if ns.name == "h3":
-                break
-            if ns.name == "p" and "Points" not in ns.text:
-                vals += ns.text
-            if ns.name == "ul":
-                bullet_points = ns.text.strip().replace("\n", ",")
-                vals = vals + " " + bullet_points
-        descriptions.append(vals)
-    descriptions = [element for element in descriptions if (len(element) > 0)]
+    descriptions = [element for element in page["descriptions"] if (len(element) > 0)]
 
     # To limit to only relvant comments, we ensure that the university name is mentioned
     # Get all university names in list
     university_names = df['University'].tolist()
 
-    # To ensure that location was probably pulled using regular expression,
-    # confirm state exits in list of states
-    us_states = ['Alaska', 'Alabama', 'Arkansas', 'Arizona', 'California', 'Colorado',
-                 'Connecticut', 'District of Columbia', 'Delaware', 'Florida', 'Georgia',
-                 'Hawaii', 'Iowa', 'Idaho', 'Illinois', 'Indiana', 'Kansas', 'Kentucky',
-                 'Louisiana', 'Massachusetts', 'Maryland', 'Maine', 'Michigan',
-                 'Minnesota', 'Missouri', 'Mississippi', 'Montana', 'North Carolina',
-                 'North Dakota', 'Nebraska', 'New Hampshire', 'New Jersey', 'New Mexico',
-                 'Nevada', 'New York', 'Ohio', 'Oklahoma', 'Oregon',
-                 'Pennsylvania', 'Rhode Island', 'South Carolina', 'South Dakota',
-                 'Tennessee', 'Texas', 'Utah', 'Virginia', 'Vermont', 'Washington',
-                 'Wisconsin', 'West Virginia', 'Wyoming']
-
     relevant_comments_dict = {}
     city_dict = {}
     state_dict = {}
@@ -350,39 +753,11 @@ def collect_and_clean_program():
         text = descriptions[i]
         university = university_names[i]
         relevant_comments_dict[university] = (text)
-        # ensure the location matched is in the format of "in city, state"
-        # note that both city and state can be composed of two words
-        match_location = re.search(r'in ([^\d\W]+(?: [^\d\W]+)?), ([^\d\W]+(?: [^\d\W]+)?)', text)
-        # check if matched and ensure that the state is a real state
-        if match_location and match_location.group()[3:].split(',')[1].strip() in us_states:
-            location = match_location.group()[3:].split(',')
-            city_dict[university] = (location[0])
-            state_dict[university] = (location[1]).strip()
-        # if the regex does not match any location, check if the description
-        # mentions a state
-        # Please note that it's entirely possible that the description includes
-        # NO information on location. For example saying University of California
-        # implies the university is in California, without stating its location
-        else:
-            state = [state for state in us_states if (state in text)]
-            if len(state) != 0:
-                state_dict[university] = state[0]
-                # in certain cases, the name of the university includes the city
-                # for example "University of Illinois – Urbana-Champaign".
-                # In these case, the description does not include location so we pull it
-                # from the university name
-            if re.search(r'–', university):
-                city_dict[university] = university.split('–')[1].strip()
-            # if the name of the city has yet to be found, look for "located"
-            elif re.search(r'located|Located', text):
-                # extra 3-word cities like "New York City", "Salt Lake City"
-                match = re.search(r'[L|l]ocated in ([^\d\W]+(?: [^\d\W]+)?(?: [^\d\W]+)?)[.|,]', text)
-                if match:
-                    city_dict[university] = match.group()[10:len(match.group()) - 1]
-                elif re.search(r'located [^,]*, [^\d\W]+', text):
-                    city_dict[university] = re.search(r'located [^,]*, [^\d\W]+', text).group().split(",")[1]
-                elif re.search(r'in the city of ', text):
-                    city_dict[university] = re.search(r'in the city of ([^\d\W]+(?: [^\d\W]+)?)', text).group()[15:]
+        city, state, _ = extract_location(text, university)
+        if city is not None:
+            city_dict[university] = city
+        if state is not None:
+            state_dict[university] = state
 
     # For 5 universities (out of 50), the location is not mentioned in the description
     # in the website (i.e the info on the website is incomplete). To avoid
@@ -0,0 +1,71 @@
+"""
+@File name: data_store
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: save pipeline outputs as csv plus a typed columnar (Parquet) copy, and load them back fast.
+"""
+
+import hashlib
+import os
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  # Parquet support is optional, csv is always written
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+
+def columnar_path(csv_path):
+    """
+    Get the path of the Parquet copy that sits next to a csv export.
+    :param csv_path: path of the csv file, e.g. merge/merged.csv
+    :return: path of the Parquet file, e.g. merge/merged.parquet
+    """
+    return os.path.splitext(csv_path)[0] + ".parquet"
+
+
+def write_table(df, csv_path, categoricals=(), encoding='utf-8-sig'):
+    """
+    Write a DataFrame as a csv export and, when pyarrow is installed, as a Parquet file
+    that keeps the dtypes so it does not need to be parsed as text again.
+    :param df: DataFrame to write
+    :param csv_path: path of the csv export
+    :param categoricals: columns stored as categoricals in the Parquet file
+    :param encoding: encoding of the csv export
+    """
+    df.to_csv(csv_path, index=False, encoding=encoding)
+
+    if HAS_PARQUET:
+        df_typed = df.copy()
+        for column in categoricals:
+            df_typed[column] = df_typed[column].astype("category")
+        df_typed.to_parquet(columnar_path(csv_path), index=False)
+
+
+def read_table(csv_path, columns=None, **csv_options):
+    """
+    Load a pipeline output, preferring the Parquet copy over the csv export.
+    The Parquet file is memory mapped and only the requested columns are read. It is skipped
+    when the csv is newer, e.g. only the csv was copied over an older output.
+    :param csv_path: path of the csv export
+    :param columns: columns to load, all columns if None
+    :param csv_options: extra options of pd.read_csv, such as dtype, used for the csv export only
+    :return: DataFrame
+    """
+    parquet_path = columnar_path(csv_path)
+    if HAS_PARQUET and os.path.exists(parquet_path) and \
+            (not os.path.exists(csv_path) or os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path)):
+        return pd.read_parquet(parquet_path, columns=columns, memory_map=True)
+
+    return pd.read_csv(csv_path, usecols=columns, **csv_options)
+
+
+def dataset_version(df):
+    """
+    Get a short fingerprint of the content of a DataFrame, used to key caches and indexes
+    built from a dataset so they are rebuilt only when the data changes.
+    :param df: DataFrame
+    :return: hex string
+    """
+    hashes = pd.util.hash_pandas_object(df, index=False)
+    return hashlib.sha256(hashes.values.tobytes()).hexdigest()[:16]
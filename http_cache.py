@@ -0,0 +1,216 @@
+"""
+@File name: http_cache
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: on-disk cache of upstream responses shared by all data collectors.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+# Blobs handed out less than this many seconds ago are never removed, a collector may not have opened them yet
+IN_USE_SECONDS = 600
+
+
+class HttpCache:
+    def __init__(self, cache_dir="./cache/http", max_bytes=512 * 1024 * 1024):
+        """ Cache upstream responses on disk so a refresh does not download unchanged sources again.
+        Entries are keyed by url and point to a blob named after the sha256 of its content,
+        so identical responses are stored once. Expired entries are revalidated with
+        ETag/Last-Modified, and the least recently used entries are evicted once the
+        blobs take more than max_bytes.
+        :param cache_dir: directory holding the index and the blobs
+        :param max_bytes: byte budget of the blobs
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.index = None
+        # Bytes downloaded per url by this process, revalidations answered 304 count 0
+        self.downloaded = {}
+        # sha256 -> last time the blob path was handed out, and blobs left to remove once unused
+        self.handed_out = {}
+        self.orphans = set()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.cache_dir, "index.json")
+
+    def blob_path(self, digest):
+        return os.path.join(self.cache_dir, "blobs", digest)
+
+    def load_index(self):
+        """
+        Load the index from disk the first time it is needed.
+        Blobs no entry points to, e.g. left in use by a previous process, are removed then,
+        unless they were written recently and may belong to another process storing them.
+        """
+        if self.index is None:
+            os.makedirs(os.path.join(self.cache_dir, "blobs"), exist_ok=True)
+            if os.path.exists(self.index_path):
+                with open(self.index_path, "r", encoding="utf-8") as fin:
+                    self.index = json.load(fin)
+            else:
+                self.index = {}
+            used = {entry["sha256"] for entry in self.index.values()}
+            for digest in os.listdir(os.path.join(self.cache_dir, "blobs")):
+                path = self.blob_path(digest)
+                if digest not in used and time.time() - os.path.getmtime(path) > IN_USE_SECONDS:
+                    os.remove(path)
+        return self.index
+
+    def save_index(self):
+        """
+        Write the index atomically, so an interrupted refresh never leaves a broken index.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as fout:
+            json.dump(self.index, fout, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def hand_out(self, digest):
+        """
+        Get the path of a blob returned to a caller, so it is not removed before it is read.
+        Must be called with the lock held.
+        """
+        self.handed_out[digest] = time.time()
+        return self.blob_path(digest)
+
+    def lookup(self, key, ttl):
+        """
+        Get the cached content of a key if it was stored less than ttl seconds ago.
+        The access time is only updated in memory, it is written with the next store.
+        :param key: url or any other source key
+        :param ttl: time to live in seconds
+        :return: path of the cached content, None if missing or expired
+        """
+        with self.lock:
+            entry = self.load_index().get(key)
+            if entry is None or not os.path.exists(self.blob_path(entry["sha256"])):
+                return None
+            if time.time() - entry["fetched_at"] > ttl:
+                return None
+            entry["last_access"] = time.time()
+            return self.hand_out(entry["sha256"])
+
+    def store(self, key, path, etag=None, last_modified=None):
+        """
+        Move a downloaded file into the cache under a key.
+        :param key: url or any other source key
+        :param path: path of the downloaded file, it is moved into the cache
+        :param etag: ETag header of the response
+        :param last_modified: Last-Modified header of the response
+        :return: path of the cached content
+        """
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as fin:
+            for block in iter(lambda: fin.read(1024 * 1024), b""):
+                sha256.update(block)
+        digest = sha256.hexdigest()
+
+        with self.lock:
+            index = self.load_index()
+            if os.path.exists(self.blob_path(digest)):
+                os.remove(path)
+            else:
+                shutil.move(path, self.blob_path(digest))
+            previous = index.get(key)
+            now = time.time()
+            index[key] = {"sha256": digest, "size": os.path.getsize(self.blob_path(digest)),
+                          "etag": etag, "last_modified": last_modified,
+                          "fetched_at": now, "last_access": now}
+            if previous is not None:
+                self.remove_blob_if_unused(previous["sha256"])
+            self.evict(keep=key)
+            self.save_index()
+            return self.hand_out(digest)
+
+    def fetch(self, url, ttl):
+        """
+        Get the content of a url, downloading it only when the cached copy is expired
+        and the server reports that it changed.
+        :param url: url to download
+        :param ttl: time to live of the cached copy in seconds
+        :return: path of the cached content
+        """
+        path = self.lookup(url, ttl)
+        if path is not None:
+            return path
+
+        request = Request(url)
+        with self.lock:
+            entry = self.load_index().get(url)
+        if entry is not None and os.path.exists(self.blob_path(entry["sha256"])):
+            if entry["etag"]:
+                request.add_header("If-None-Match", entry["etag"])
+            if entry["last_modified"]:
+                request.add_header("If-Modified-Since", entry["last_modified"])
+
+        try:
+            response = urlopen(request)
+        except HTTPError as error:
+            if error.code != 304:
+                raise
+            # Not modified, the cached copy is fresh for another ttl
+            with self.lock:
+                entry["fetched_at"] = entry["last_access"] = time.time()
+                self.save_index()
+                return self.hand_out(entry["sha256"])
+
+        # Stream the body to a temporary file, the blob is named after its hash afterwards
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with response, os.fdopen(fd, "wb") as fout:
+            shutil.copyfileobj(response, fout, 1024 * 1024)
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+        with self.lock:
+            self.downloaded[url] = self.downloaded.get(url, 0) + os.path.getsize(tmp_path)
+        return self.store(url, tmp_path, etag=etag, last_modified=last_modified)
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the blobs fit in the byte budget.
+        Entries whose blob was handed out recently are kept, it may not have been read yet.
+        Must be called with the lock held.
+        :param keep: key that is never evicted, usually the entry just stored
+        """
+        for digest in list(self.orphans):
+            self.remove_blob_if_unused(digest)
+
+        blob_sizes = {entry["sha256"]: entry["size"] for entry in self.index.values()}
+        total = sum(blob_sizes.values())
+        now = time.time()
+        for key, entry in sorted(self.index.items(), key=lambda item: item[1]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep or now - self.handed_out.get(entry["sha256"], 0) < IN_USE_SECONDS:
+                continue
+            del self.index[key]
+            if self.remove_blob_if_unused(entry["sha256"]):
+                total -= blob_sizes[entry["sha256"]]
+
+    def remove_blob_if_unused(self, digest):
+        """
+        Remove a blob once no entry points to it any more, a blob may be shared by
+        several urls with the same content. A blob handed out recently is only removed by
+        a later call, see evict. Must be called with the lock held.
+        :param digest: sha256 of the blob
+        :return: True if the blob was removed
+        """
+        if any(entry["sha256"] == digest for entry in self.index.values()):
+            self.orphans.discard(digest)
+            return False
+        if time.time() - self.handed_out.get(digest, 0) < IN_USE_SECONDS:
+            self.orphans.add(digest)
+            return False
+        self.orphans.discard(digest)
+        self.handed_out.pop(digest, None)
+        if os.path.exists(self.blob_path(digest)):
+            os.remove(self.blob_path(digest))
+        return True
@@ -0,0 +1,265 @@
+"""
+@File name: instrumentation
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: record wall time, rows, downloaded bytes and peak memory of every pipeline stage as JSON lines.
+"""
+
+import contextlib
+import datetime
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import pandas as pd
+
+try:
+    import resource  # Unix only, Windows reads the peak working set instead
+except ImportError:
+    resource = None
+
+METRICS_DIR = "metrics"
+
+# Bytes downloaded and raw rows read by every source since the process started,
+# counted by the collectors, whichever run is active
+SOURCE_BYTES = Counter()
+SOURCE_ROWS = Counter()
+source_lock = threading.Lock()
+
+# Run the instrumented functions report to, None when nothing is recorded
+active_run = None
+
+
+def record_source(source, bytes_downloaded=0, rows_read=0):
+    """
+    Count what a collector downloaded or read from its upstream source.
+    :param source: name of the source, the same as its pipeline stage
+    :param bytes_downloaded: bytes downloaded from the network, cache hits count 0
+    :param rows_read: raw rows read before cleaning
+    """
+    with source_lock:
+        SOURCE_BYTES[source] += bytes_downloaded
+        SOURCE_ROWS[source] += rows_read
+
+
+def count_rows(value):
+    """
+    Count the rows of a DataFrame, or of all the DataFrames of a tuple or list.
+    :return: number of rows, None if value holds no DataFrame
+    """
+    if isinstance(value, pd.DataFrame):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        counts = [len(item) for item in value if isinstance(item, pd.DataFrame)]
+        return sum(counts) if counts else None
+    return None
+
+
+def max_rss():
+    """
+    Get the highest resident memory of the process since it started, read from the OS for free.
+    :return: bytes, None if it cannot be read on this platform
+    """
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return rss if sys.platform == "darwin" else rss * 1024
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+
+class MetricsRun:
+    def __init__(self, name="refresh", total=None, listener=None, metrics_dir=METRICS_DIR, trace_memory=False):
+        """ One instrumented run, written to metrics/run-<name>-<timestamp>.jsonl.
+        Every stage emits a started event and a finished, skipped or failed event. The
+        events are appended to the file and passed to the listener, so a progress bar
+        can be driven by exactly what is recorded.
+        By default peak_mb is the highest resident memory of the process when the stage ends,
+        which costs nothing but is a high-water mark since the process started, so a stage
+        only shows a higher value than the previous ones when it raised the peak.
+        With trace_memory, peak_mb comes from tracemalloc instead, whose peak is global to
+        the process: at every stage boundary the peak since the previous boundary is credited
+        to all the stages running at that time, then reset. Stages running at the same time
+        therefore report the peak of the process while they ran. The memory field of every
+        event tells which of the two was recorded.
+        :param name: name of the run
+        :param total: number of top level stages, to add done and total to the events
+        :param listener: optional callback receiving every event, called from the thread
+        running the stage, so it must be thread safe when stages run in worker threads
+        :param metrics_dir: directory of the JSON lines files
+        :param trace_memory: measure the peak memory of every stage with tracemalloc; off by
+        default, as tracing slows every allocation of the process, e.g. only for profiling runs
+        """
+        self.run_id = "{}-{}".format(name, datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f"))
+        self.path = os.path.join(metrics_dir, "run-{}.jsonl".format(self.run_id))
+        self.total = total
+        self.listener = listener
+        self.trace_memory = trace_memory
+        self.started_tracing = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.peaks = {}
+        self.done = 0
+        self.start_time = None
+
+    def open_stages(self):
+        # Stages opened by the current thread, innermost last
+        if not hasattr(self.local, "stages"):
+            self.local.stages = []
+        return self.local.stages
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.start_time = time.perf_counter()
+
+    def close(self):
+        self.emit({"stage": self.run_id, "status": "run_finished",
+                   "wall_seconds": round(time.perf_counter() - self.start_time, 4)})
+        if self.started_tracing:
+            tracemalloc.stop()
+
+    def emit(self, event):
+        """
+        Write one event to the metrics file and pass it to the listener.
+        """
+        with self.lock:
+            if event["status"] in ("finished", "skipped") and event.get("depth") == 0:
+                self.done += 1
+            event = dict(event, run_id=self.run_id, time=datetime.datetime.now().isoformat(), done=self.done,
+                         total=self.total)
+            with open(self.path, "a", encoding="utf-8") as fout:
+                fout.write(json.dumps(event) + "\n")
+        if self.listener is not None:
+            self.listener(event)
+
+    def checkpoint(self):
+        """
+        Credit the memory peak since the previous stage boundary to every running stage.
+        Must be called with the lock held.
+        """
+        if not tracemalloc.is_tracing():
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        for key in self.peaks:
+            self.peaks[key] = max(self.peaks[key], peak)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Measure one stage. The body may set rows_in, rows_out or status ("skipped")
+        in the yielded dict. Opening a stage that the same thread already has open
+        yields the dict of the open stage, so a pipeline step and the instrumented
+        function it calls are recorded once.
+        :param name: name of the stage, also the source name of a collector
+        """
+        open_stages = self.open_stages()
+        for open_name, metrics in open_stages:
+            if open_name == name:
+                yield metrics
+                return
+
+        metrics = {}
+        key = (name, threading.get_ident())
+        with source_lock:
+            bytes_before, rows_before = SOURCE_BYTES[name], SOURCE_ROWS[name]
+        with self.lock:
+            self.checkpoint()
+            self.peaks[key] = 0
+        depth = len(open_stages)
+        open_stages.append((name, metrics))
+        self.emit({"stage": name, "status": "started", "depth": depth})
+
+        start = time.perf_counter()
+        status = "finished"
+        try:
+            yield metrics
+        except Exception as error:
+            status = "failed"
+            metrics["error"] = repr(error)
+            raise
+        finally:
+            wall_seconds = time.perf_counter() - start
+            open_stages.pop()
+            with self.lock:
+                self.checkpoint()
+                peak = self.peaks.pop(key) if self.trace_memory else max_rss()
+            with source_lock:
+                bytes_downloaded = SOURCE_BYTES[name] - bytes_before
+                rows_read = SOURCE_ROWS[name] - rows_before
+
+            rows_in = metrics.pop("rows_in", None)
+            if rows_in is None and rows_read:
+                rows_in = rows_read
+            event = {"stage": name, "status": metrics.pop("status", status), "depth": depth,
+                     "wall_seconds": round(wall_seconds, 4), "rows_in": rows_in,
+                     "rows_out": metrics.pop("rows_out", None),
+                     "bytes_downloaded": bytes_downloaded,
+                     "peak_mb": None if peak is None else round(peak / 2 ** 20, 2),
+                     "memory": "traced" if self.trace_memory else "max_rss"}
+            event.update(metrics)
+            self.emit(event)
+
+
+@contextlib.contextmanager
+def start_run(name="refresh", total=None, listener=None, metrics_dir=METRICS_DIR, trace_memory=False):
+    """
+    Record every instrumented stage called until the block exits.
+    :return: the MetricsRun, see MetricsRun for the parameters
+    """
+    global active_run
+    run = MetricsRun(name, total, listener, metrics_dir, trace_memory)
+    run.start()
+    previous, active_run = active_run, run
+    try:
+        yield run
+    finally:
+        active_run = previous
+        run.close()
+
+
+def instrumented(name):
+    """
+    Decorate a stage function so every call is measured while a run is active.
+    Rows in are the rows of the DataFrame arguments, or the raw rows the collector
+    read from its source, rows out are the rows of the returned DataFrames.
+    :param name: name of the stage
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            run = active_run
+            if run is None:
+                return func(*args, **kwargs)
+            with run.stage(name) as metrics:
+                rows_in = count_rows(list(args) + list(kwargs.values()))
+                if rows_in is not None:
+                    metrics["rows_in"] = rows_in
+                result = func(*args, **kwargs)
+                metrics["rows_out"] = count_rows(result)
+            return result
+        return wrapper
+    return decorator
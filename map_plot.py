@@ -4,47 +4,55 @@
 @Purpose: plot a map of every state in U.S. based on university counts.
 """
 
-import pandas as pd
+import hashlib
+import importlib.util
 import os
-import plotly.express as px
+import webbrowser
+
+import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
 
+from data_store import dataset_version
 
-def map_plot(df_raw):
-    df_raw = df_raw.dropna(subset=['City', 'State'], how='any')
-
-    state_count = df_raw['State'].value_counts().reset_index()
-    state_count.columns = ['State', 'Count']
-    df = state_count
-    state_abbr = {
-        'California': 'CA',
-        'New York': 'NY',
-        'Arizona': 'AZ',
-        'Nebraska': 'NE',
-        'Colorado': 'CO',
-        'Utah': 'UT',
-        'Ohio': 'OH',
-        'Connecticut': 'CT',
-        'Minnesota': 'MN',
-        'Florida': 'FL',
-        'Wisconsin': 'WI',
-        'Georgia': 'GA',
-        'Pennsylvania': 'PA',
-        'Michigan': 'MI',
-        'North Carolina': 'NC',
-        'Indiana': 'IN',
-        'New Jersey': 'NJ',
-        'Massachusetts': 'MA',
-        'Maryland': 'MD',
-        'Illinois': 'IL',
-        'Texas': 'TX',
-        'Tennessee': 'TN'
-    }
-    df['State'] = df['State'].map(state_abbr)
+# Static images need the optional kaleido package, otherwise maps are saved as html only
+HAS_KALEIDO = importlib.util.find_spec("kaleido") is not None
+MAP_CACHE_DIR = os.path.join("cache", "maps")
+
+STATE_ABBR = {
+    'Alabama': 'AL', 'Alaska': 'AK', 'Arizona': 'AZ', 'Arkansas': 'AR', 'California': 'CA',
+    'Colorado': 'CO', 'Connecticut': 'CT', 'Delaware': 'DE', 'District of Columbia': 'DC',
+    'Florida': 'FL', 'Georgia': 'GA', 'Hawaii': 'HI', 'Idaho': 'ID', 'Illinois': 'IL',
+    'Indiana': 'IN', 'Iowa': 'IA', 'Kansas': 'KS', 'Kentucky': 'KY', 'Louisiana': 'LA',
+    'Maine': 'ME', 'Maryland': 'MD', 'Massachusetts': 'MA', 'Michigan': 'MI', 'Minnesota': 'MN',
+    'Mississippi': 'MS', 'Missouri': 'MO', 'Montana': 'MT', 'Nebraska': 'NE', 'Nevada': 'NV',
+    'New Hampshire': 'NH', 'New Jersey': 'NJ', 'New Mexico': 'NM', 'New York': 'NY',
+    'North Carolina': 'NC', 'North Dakota': 'ND', 'Ohio': 'OH', 'Oklahoma': 'OK', 'Oregon': 'OR',
+    'Pennsylvania': 'PA', 'Rhode Island': 'RI', 'South Carolina': 'SC', 'South Dakota': 'SD',
+    'Tennessee': 'TN', 'Texas': 'TX', 'Utah': 'UT', 'Vermont': 'VT', 'Virginia': 'VA',
+    'Washington': 'WA', 'West Virginia': 'WV', 'Wisconsin': 'WI', 'Wyoming': 'WY'
+}
+
+# dataset version -> (state code of every program, state abbreviation of every code)
+state_codes_cache = {}
+
+
+def state_codes(df_raw, version):
+    """
+    Map every program to its state once per dataset version. Programs without a city
+    or state, as before, are left out with code -1.
+    """
+    if version not in state_codes_cache:
+        valid = df_raw['City'].notna() & df_raw['State'].notna()
+        abbr = df_raw['State'].astype(object).map(STATE_ABBR).where(valid)
+        state_codes_cache[version] = pd.factorize(abbr)
+    return state_codes_cache[version]
 
+
+def build_figure(states, counts):
     fig = go.Figure(data=go.Choropleth(
-        locations=df['State'],  # using abbreviations
-        z=df['Count'].astype(float),  # Data to be color-coded
+        locations=states,  # using abbreviations
+        z=counts.astype(float),  # Data to be color-coded
         locationmode='USA-states',  # set of locations match entries in `locations`
         colorscale='Reds',
         colorbar_title="Count",
@@ -54,8 +62,43 @@ def map_plot(df_raw):
         title_text='CS Program Distribution Heatmap',
         geo_scope='usa',
     )
+    return fig
+
+
+def render_map(df_raw, mask=None, filter_key="All", version=None, image=False):
+    """
+    Render the map of program counts per state, reusing the cached file of the same
+    dataset version and filter when it exists.
+    :param df_raw: merged program data
+    :param mask: optional boolean mask of the programs selected by the active filter
+    :param filter_key: text describing the active filter, part of the cache key
+    :param version: dataset version, computed from df_raw if not given
+    :param image: render a png (needs kaleido) instead of an interactive html file
+    :return: path of the rendered file
+    """
+    version = version or dataset_version(df_raw)
+    key = hashlib.sha256("{}|{}".format(version, filter_key).encode()).hexdigest()[:16]
+    path = os.path.join(MAP_CACHE_DIR, key + (".png" if image else ".html"))
+    if os.path.exists(path):
+        return path
+
+    codes, states = state_codes(df_raw, version)
+    if mask is not None:
+        codes = codes[mask]
+    counts = np.bincount(codes[codes >= 0], minlength=len(states))
+    fig = build_figure(np.asarray(states)[counts > 0], counts[counts > 0])
 
-    fig.show()
+    os.makedirs(MAP_CACHE_DIR, exist_ok=True)
+    if image:
+        fig.write_image(path)
+    else:
+        # plotly.js is written once into the cache folder and shared by every map
+        fig.write_html(path, include_plotlyjs="directory")
+    return path
+
+
+def map_plot(df_raw):
+    webbrowser.open("file://" + os.path.abspath(render_map(df_raw)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,259 @@
+"""
+@File name: pipeline
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: refresh the scraped sources and rebuild only the stages whose inputs changed.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+import data_collection as dc
+from data_cleaning_merge import merge
+from create_scatterplot import prep_weather_data_for_scatterplot
+from data_store import read_table
+from instrumentation import start_run
+
+MANIFEST_PATH = os.path.join("cache", "pipeline_manifest.json")
+
+
+class Stage:
+    def __init__(self, name, func, output, args=(), probe=None, deps=None, load=pd.read_csv, options=None):
+        """ One step of the refresh.
+        A collector stage has a probe that fingerprints its upstream source, a downstream
+        stage lists the stages it depends on. deps maps a stage name to the columns of its
+        output that matter here, or None when the whole output file matters.
+        :param name: name of the stage
+        :param func: function that runs the stage
+        :param output: path of the file written by the stage
+        :param args: names of the stages whose results are passed to func, in order
+        :param probe: function returning a fingerprint of the upstream source, None if unknown
+        :param deps: stages this stage is built from
+        :param load: function reading the output back when the stage is skipped
+        :param options: dict of keyword argument of func to the refresh option passed to it
+        """
+        self.name = name
+        self.func = func
+        self.output = output
+        self.args = args
+        self.probe = probe
+        self.deps = deps or {}
+        self.load = load
+        self.options = options or {}
+
+
+def file_fingerprint(path):
+    """
+    Fingerprint a file by the sha256 of its content.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as fin:
+        for block in iter(lambda: fin.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def frame_fingerprint(df, columns):
+    """
+    Fingerprint only some columns of a DataFrame, so changes in other columns are ignored.
+    """
+    hashes = pd.util.hash_pandas_object(df[columns], index=False)
+    return hashlib.sha256(hashes.values.tobytes()).hexdigest()
+
+
+def cached_digest(url, source):
+    """
+    Fingerprint an upstream url by the content hash of its cached response.
+    The cache revalidates with the server when the entry is expired.
+    """
+    return os.path.basename(dc.fetch_source(url, source))
+
+
+def probe_population():
+    if dc.CACHE is None:
+        return None
+    return cached_digest(dc.POPULATION_URL, "population")
+
+
+def probe_safety():
+    # The export needs a browser, so it only counts as unchanged while the cached copy is fresh
+    if dc.CACHE is None:
+        return None
+    if dc.SAFETY_EXPORT_URL:
+        return cached_digest(dc.SAFETY_EXPORT_URL, "safety")
+    path = dc.CACHE.lookup(dc.SAFETY_URL, dc.CACHE_TTL["safety"])
+    return os.path.basename(path) if path else None
+
+
+def probe_weather():
+    if dc.CACHE is None:
+        return None
+    urls = [os.path.join(dc.WEATHER_BASE_URL, dc.WEATHER_FILE_TEMPLATE.format(type_, month))
+            for month in dc.WEATHER_MONTHS for type_ in dc.WEATHER_TYPES]
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        digests = list(executor.map(lambda url: cached_digest(url, "weather"), urls))
+    return hashlib.sha256("".join(digests).encode()).hexdigest()
+
+
+def probe_program():
+    if dc.CACHE is None:
+        return None
+    return cached_digest(dc.PROGRAM_URL, "program")
+
+
+STAGES = [
+    Stage("population", dc.collect_and_clean_pop,
+          os.path.join("population", "population_county_2022.csv"), probe=probe_population),
+    Stage("safety", dc.collect_and_clean_safety,
+          os.path.join("safety", "crinimal_offenses_on_campus_2021.csv"), probe=probe_safety,
+          options={"headless": "headless", "timeout": "safety_timeout"}),
+    # The daily file is fingerprinted, the merge only reads its state by season aggregate
+    Stage("weather", dc.collect_and_clean_weather, dc.WEATHER_OUTPUT,
+          probe=probe_weather, load=lambda path: dc.load_weather_cube(dc.WEATHER_SEASON_OUTPUT)),
+    Stage("program", dc.collect_and_clean_program,
+          os.path.join("program", "scraped_data_program.csv"), probe=probe_program,
+          load=lambda path: pd.read_csv(path, encoding='utf-8-sig')),
+    Stage("merge", merge, os.path.join("merge", "merged.csv"),
+          args=("population", "safety", "weather", "program"),
+          deps={"population": None, "safety": None, "weather": None, "program": None},
+          load=read_table),
+    # The scatter data only uses State and University of the merged table, so a tuition
+    # update does not reload the monthly weather
+    Stage("scatter", prep_weather_data_for_scatterplot, os.path.join("merge", "weather_merged.csv"),
+          deps={"weather": None, "merge": ["State", "University"]},
+          load=read_table),
+]
+
+
+def load_manifest():
+    if os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as fin:
+            return json.load(fin)
+    return {}
+
+
+def save_manifest(manifest):
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fout:
+        json.dump(manifest, fout, indent=1)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def input_fingerprints(stage, stages, manifest):
+    """
+    Fingerprint everything a stage is built from.
+    :return: dict of input name to fingerprint, a fingerprint is None when it is unknown
+    """
+    if stage.probe is not None:
+        return {"upstream": stage.probe()}
+
+    inputs = {}
+    for dep, columns in stage.deps.items():
+        if columns is None:
+            inputs[dep] = manifest.get(dep, {}).get("output")
+        else:
+            inputs[dep] = frame_fingerprint(read_table(stages[dep].output, columns=columns), columns)
+    return inputs
+
+
+def refresh(force=False, progress=None, max_workers=4, trace_memory=False, headless=None, safety_timeout=120):
+    """
+    Refresh the data, skipping every stage whose inputs did not change since its last run.
+    Stages run as a DAG in a pool of worker threads: the four collectors run at the same
+    time, merge starts once they are all done and the scatter prep once weather and merge are.
+    Every stage is measured and recorded in metrics/run-refresh-<timestamp>.jsonl.
+    :param force: rerun every stage
+    :param progress: optional callback receiving the same events as the metrics file, for
+    every stage that starts, finishes, is skipped or fails, with keys stage, status, done and
+    total among others. It is called from the worker threads, so it must be thread safe,
+    e.g. queue.Queue.put
+    :param max_workers: number of stages run at the same time
+    :param trace_memory: record the precise peak memory of every stage with tracemalloc, which
+    slows every allocation; by default the cheap peak resident memory of the process is recorded
+    :param headless: run Chrome without a window for the safety export, None to do so only
+    when there is no display, e.g. for a scheduled refresh
+    :param safety_timeout: seconds to wait for the safety export to finish downloading
+    :return: merged program data, monthly weather data per university, names of the stages that ran
+    """
+    stages = {stage.name: stage for stage in STAGES}
+    options = {"headless": headless, "safety_timeout": safety_timeout}
+    manifest = load_manifest()
+    results = {}
+    results_lock = threading.Lock()
+    ran = []
+
+    def result(name):
+        # Outputs of skipped stages are only read back when a later stage needs them
+        with results_lock:
+            if name not in results:
+                results[name] = stages[name].load(stages[name].output)
+            return results[name]
+
+    def run_stage(stage):
+        # The probe is measured with the stage, revalidating a source is often where the time goes
+        with run.stage(stage.name) as metrics:
+            inputs = input_fingerprints(stage, stages, manifest)
+            record = manifest.get(stage.name, {})
+            unchanged = (not force and os.path.exists(stage.output)
+                         and None not in inputs.values() and record.get("inputs") == inputs)
+            if unchanged:
+                metrics["status"] = "skipped"
+                return False, inputs, None
+
+            df = stage.func(*[result(name) for name in stage.args],
+                            **{arg: options[option] for arg, option in stage.options.items()})
+            if stage.probe is not None:
+                # A collector may have just filled the cache, e.g. the safety export
+                inputs = input_fingerprints(stage, stages, manifest)
+            return True, inputs, df
+
+    def requirements(stage):
+        return set(stage.args) | set(stage.deps)
+
+    done = set()
+    pending = list(STAGES)
+    with start_run("refresh", total=len(STAGES), listener=progress, trace_memory=trace_memory) as run, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while pending or running:
+            # Start every stage whose inputs are complete
+            for stage in [stage for stage in pending if requirements(stage) <= done]:
+                pending.remove(stage)
+                running[executor.submit(run_stage, stage)] = stage
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    stage_ran, inputs, df = future.result()
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+
+                if stage_ran:
+                    with results_lock:
+                        results[stage.name] = df
+                    manifest[stage.name] = {"inputs": inputs, "output": file_fingerprint(stage.output)}
+                    save_manifest(manifest)
+                    ran.append(stage.name)
+                done.add(stage.name)
+
+    return result("merge"), result("scatter"), ran
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the data, rerunning only the stages whose inputs changed.")
+    parser.add_argument("--force", action="store_true", help="rerun every stage")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="record the precise peak memory of every stage with tracemalloc, slower")
+    args = parser.parse_args()
+
+    df_merged, df_weather_merged, ran = refresh(force=args.force, trace_memory=args.trace_memory)
+    print("Stages rebuilt: {}".format(", ".join(ran) if ran else "none"))
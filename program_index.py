@@ -0,0 +1,77 @@
+"""
+@File name: program_index
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: precomputed bitmap indexes to filter programs on the same criteria as the GUI drop-down boxes.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Columns filtered on an exact value, and columns filtered on a numeric range
+EQUALITY_COLUMNS = ["State", "City", "University", "population_category",
+                    "temperature_category", "safety_category"]
+RANGE_COLUMNS = ["Ranking", "Points"]
+
+
+class ProgramIndex:
+    def __init__(self, df):
+        """ Build the indexes once when the data is loaded.
+        Every (column, value) pair of the equality columns gets a bitmap of the rows holding
+        that value, packed 8 rows per byte. Ranking and Points are kept as sorted arrays with
+        the row of every entry, so a range selects a contiguous slice of rows.
+        A filter then costs a few bitwise ANDs, whatever the number of programs.
+        :param df: merged program data
+        """
+        self.size = len(df)
+        self.all_rows = np.packbits(np.ones(self.size, dtype=bool))
+        self.no_rows = np.packbits(np.zeros(self.size, dtype=bool))
+
+        self.bitmaps = {}
+        for column in EQUALITY_COLUMNS:
+            codes, uniques = pd.factorize(df[column])
+            # Rows with a missing value get code -1 and never match a selection
+            self.bitmaps[column] = {str(value): np.packbits(codes == i) for i, value in enumerate(uniques)}
+
+        self.sorted_values = {}
+        self.sorted_rows = {}
+        for column in RANGE_COLUMNS:
+            values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+            rows = np.argsort(values, kind='stable')
+            self.sorted_values[column] = values[rows]
+            self.sorted_rows[column] = rows
+
+    def range_bitmap(self, column, lower_bound, upper_bound):
+        """
+        Get the bitmap of the rows whose value is between two bounds, both included.
+        """
+        start = np.searchsorted(self.sorted_values[column], lower_bound, side='left')
+        end = np.searchsorted(self.sorted_values[column], upper_bound, side='right')
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.sorted_rows[column][start:end]] = True
+        return np.packbits(mask)
+
+    def selection_bitmap(self, label, value):
+        """
+        Get the bitmap of one drop-down selection, using the same values as the GUI:
+        "TopN" for Ranking, "low-high" for Points and an exact value for the other columns.
+        """
+        if label == "Ranking":
+            return self.range_bitmap(label, 1, int(value.strip("Top")))
+        if label == "Points":
+            lower_bound, upper_bound = value.split("-")
+            return self.range_bitmap(label, int(lower_bound), int(upper_bound))
+        return self.bitmaps[label].get(value, self.no_rows)
+
+    def query(self, selections):
+        """
+        Filter programs on several selections at once.
+        :param selections: dict of column to selected value, "All" or an empty value is ignored
+        :return: boolean mask of the matching rows
+        """
+        result = self.all_rows
+        for label, value in selections.items():
+            if not value or value == "All":
+                continue
+            result = result & self.selection_bitmap(label, value)
+
+        return np.unpackbits(result, count=self.size).astype(bool)
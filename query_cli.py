@@ -0,0 +1,133 @@
+"""
+@File name: query_cli
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: filter programs from the command line, many saved filter profiles per run, without the GUI.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import pandas as pd
+
+from data_store import read_table
+from program_index import EQUALITY_COLUMNS, RANGE_COLUMNS, ProgramIndex
+
+FILTER_COLUMNS = RANGE_COLUMNS + EQUALITY_COLUMNS
+
+
+def load_programs(path, columns=None):
+    """
+    Load the merged program data and build its filter index once.
+    :param path: path of merged.csv, its columnar copy is read when it exists
+    :param columns: columns to output, None for all of them
+    :return: program data, ProgramIndex
+    """
+    if columns is not None:
+        columns = list(dict.fromkeys(FILTER_COLUMNS + columns))
+    df = read_table(path, columns=columns)
+    # Same as the GUI, the drop-down values are strings
+    df['Ranking'] = df['Ranking'].astype(str)
+    return df, ProgramIndex(df)
+
+
+def read_queries(lines):
+    """
+    Parse saved filter profiles, one JSON object per line, e.g.
+    {"id": "ca-top20", "State": "California", "Ranking": "Top20", "Points": "1-10"}
+    Values follow the GUI drop-down boxes: "TopN" for Ranking, "low-high" for Points,
+    an exact value for the other columns, and "All" or a missing column for no filter.
+    Blank lines and lines starting with # are skipped.
+    :param lines: iterable of text lines
+    :return: generator of (query id, selections, error message)
+    """
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            query = json.loads(line)
+        except json.JSONDecodeError as error:
+            yield line_number, None, "line {}: invalid JSON, {}".format(line_number, error)
+            continue
+        if not isinstance(query, dict):
+            yield line_number, None, "line {}: a query must be a JSON object".format(line_number)
+            continue
+
+        query_id = query.pop("id", line_number)
+        unknown = [column for column in query if column not in FILTER_COLUMNS]
+        if unknown:
+            yield query_id, None, "query {}: unknown filter columns {}".format(query_id, unknown)
+            continue
+        yield query_id, {column: str(value) for column, value in query.items()}, None
+
+
+def run_queries(df, index, queries, output_format="json", count_only=False, out=None):
+    """
+    Evaluate every query against the loaded data and stream the results as soon as they are ready.
+    Each output row holds the query id followed by the program columns, or the number
+    of matching programs with count_only.
+    :param df: program data
+    :param index: ProgramIndex of df
+    :param queries: iterable of (query id, selections, error message)
+    :param output_format: "json" for JSON lines, "csv" for a single csv table
+    :param count_only: only output the number of matching programs of every query
+    :param out: text stream receiving the results, defaults to stdout
+    :return: number of queries that could not be evaluated
+    """
+    out = out or sys.stdout
+    errors = 0
+    header = True
+    for query_id, selections, error in queries:
+        if error is not None:
+            print(error, file=sys.stderr)
+            errors += 1
+            continue
+
+        try:
+            mask = index.query(selections)
+        except ValueError as error:
+            # Malformed values, e.g. "Top" for Ranking or "5" for Points
+            print("query {}: invalid value, {}".format(query_id, error), file=sys.stderr)
+            errors += 1
+            continue
+        if count_only:
+            result = pd.DataFrame({"count": [int(mask.sum())]})
+        else:
+            result = df[mask].copy()
+        result.insert(0, "query", query_id)
+
+        if output_format == "csv":
+            result.to_csv(out, index=False, header=header)
+            header = False
+        elif len(result):
+            out.write(result.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n") + "\n")
+        out.flush()
+
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filter programs with saved filter profiles, one JSON object "
+                                                 "per line, using the same filters as the GUI.")
+    parser.add_argument("queries", nargs="?", default="-", help="file of queries, - or nothing for stdin")
+    parser.add_argument("--data", default=os.path.join("merge_previous", "merged.csv"),
+                        help="merged program data")
+    parser.add_argument("--format", choices=["json", "csv"], default="json", help="output format")
+    parser.add_argument("--columns", nargs="+", help="program columns to output, all by default")
+    parser.add_argument("--count", action="store_true", help="only output the number of matches per query")
+    args = parser.parse_args()
+
+    df, index = load_programs(args.data, args.columns)
+    if args.columns:
+        df = df[args.columns]
+
+    fin = sys.stdin if args.queries == "-" else open(args.queries, "r", encoding="utf-8")
+    with fin:
+        errors = run_queries(df, index, read_queries(fin), args.format, args.count)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
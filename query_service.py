@@ -0,0 +1,244 @@
+"""
+@File name: query_service
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: serve program filters, program details and monthly temperatures over HTTP from one shared in-memory copy.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import numpy as np
+
+from data_store import columnar_path, dataset_version, read_table
+from program_index import EQUALITY_COLUMNS, RANGE_COLUMNS, ProgramIndex
+
+# Columns of the filter results, the same as the text box of the GUI
+SUMMARY_COLUMNS = ["University", "Ranking", "State", "City", "Points", "In_State_Tuition", "Out_of_State_Tuition",
+                   "population_category", "safety_category", "temperature_category"]
+DATA_FILES = ["merged.csv", "weather_merged.csv"]
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 503: "Service Unavailable"}
+
+
+class Dataset:
+    def __init__(self, data_dir):
+        """ One immutable load of the pipeline outputs with everything needed to answer queries.
+        Every row is encoded to JSON once here, so a query only joins precomputed strings.
+        :param data_dir: directory holding merged.csv and weather_merged.csv
+        """
+        df = read_table(os.path.join(data_dir, "merged.csv"))
+        # Same as the GUI, the drop-down values are strings
+        df['Ranking'] = df['Ranking'].astype(str)
+        df_weather = read_table(os.path.join(data_dir, "weather_merged.csv"))
+
+        self.version = dataset_version(df)
+        self.loaded_at = datetime.datetime.now().isoformat(timespec="seconds")
+        self.size = len(df)
+        self.index = ProgramIndex(df)
+        columns = [column for column in SUMMARY_COLUMNS if column in df.columns]
+        self.summaries = df[columns].to_json(orient="records", lines=True, force_ascii=False).splitlines()
+        self.details = df.to_json(orient="records", lines=True, force_ascii=False).splitlines()
+        self.rows_by_university = {university: row for row, university in enumerate(df["University"])}
+
+        self.weather = {}
+        df_weather = df_weather.sort_values("Month", kind="stable")
+        for university, group in df_weather.groupby("University", sort=False, observed=True):
+            self.weather[university] = json.dumps({
+                "months": group["Month"].astype(int).tolist(),
+                "temperature_avg": np.round(group["Temperature_avg"].astype(float), 2).tolist()})
+
+
+def data_signature(data_dir):
+    """
+    Fingerprint the pipeline outputs by the size and modification time of their files.
+    :return: tuple, None while a file is missing
+    """
+    signature = []
+    for name in DATA_FILES:
+        for path in (os.path.join(data_dir, name), columnar_path(os.path.join(data_dir, name))):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                signature.append((path, stat.st_size, stat.st_mtime_ns))
+            elif path.endswith(".csv"):
+                return None
+    return tuple(signature)
+
+
+class QueryService:
+    def __init__(self, data_dir="merge_previous", poll_interval=2.0):
+        """ HTTP service answering from a Dataset that is swapped as a whole on reload.
+        A request keeps the Dataset it started with, so it never sees half of a reload.
+        :param data_dir: directory holding the pipeline outputs
+        :param poll_interval: seconds between two checks of the files
+        """
+        self.data_dir = data_dir
+        self.poll_interval = poll_interval
+        self.dataset = None
+        self.signature = None
+        self.port = None
+
+    async def reload(self):
+        """
+        Load the files in a worker thread, so queries keep being answered, then swap the Dataset.
+        :return: True if a new Dataset is served
+        """
+        signature = data_signature(self.data_dir)
+        if signature is None:
+            return False
+        dataset = await asyncio.get_running_loop().run_in_executor(None, Dataset, self.data_dir)
+        # The files must not have changed while they were read, or the load mixes two versions
+        if data_signature(self.data_dir) != signature:
+            return False
+        self.dataset, self.signature = dataset, signature
+        print("Serving {} programs, version {}".format(dataset.size, dataset.version))
+        return True
+
+    async def watch(self):
+        """
+        Reload once the outputs changed and stayed unchanged for a whole poll interval,
+        so a pipeline still writing them is not picked up halfway.
+        """
+        previous = self.signature
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            signature = data_signature(self.data_dir)
+            if signature is not None and signature != self.signature and signature == previous:
+                try:
+                    await self.reload()
+                except Exception as error:
+                    # Keep serving the previous version, the next change is tried again
+                    print("Reload failed: {!r}".format(error))
+            previous = signature
+
+    def route(self, method, target):
+        """
+        Answer one request.
+        :return: status code, JSON body
+        """
+        if method != "GET":
+            return 405, json.dumps({"error": "only GET is supported"})
+        dataset = self.dataset
+        if dataset is None:
+            return 503, json.dumps({"error": "no data loaded"})
+
+        parts = urlsplit(target)
+        params = dict(parse_qsl(parts.query))
+        path = unquote(parts.path).rstrip("/")
+
+        if path == "/health":
+            return 200, json.dumps({"version": dataset.version, "programs": dataset.size,
+                                    "loaded_at": dataset.loaded_at})
+
+        if path == "/programs":
+            # Filters use the values of the GUI drop-down boxes, e.g. ?State=Ohio&Ranking=Top20&Points=1-10
+            limit = int(params.pop("limit", dataset.size))
+            offset = int(params.pop("offset", 0))
+            if limit < 0 or offset < 0:
+                return 400, json.dumps({"error": "limit and offset must not be negative"})
+            unknown = [key for key in params if key not in RANGE_COLUMNS + EQUALITY_COLUMNS]
+            if unknown:
+                return 400, json.dumps({"error": "unknown filter columns {}".format(unknown)})
+            rows = np.flatnonzero(dataset.index.query(params))
+            page = rows[offset:offset + limit]
+            return 200, '{{"version":{},"count":{},"programs":[{}]}}'.format(
+                json.dumps(dataset.version), len(rows), ",".join(dataset.summaries[row] for row in page))
+
+        if path in ("/program", "/weather"):
+            university = params.get("university")
+            if university not in dataset.rows_by_university:
+                return 404, json.dumps({"error": "unknown university {}".format(university)})
+            if path == "/program":
+                body = dataset.details[dataset.rows_by_university[university]]
+            else:
+                body = dataset.weather.get(university, '{"months":[],"temperature_avg":[]}')
+            return 200, '{{"version":{},"university":{},"data":{}}}'.format(
+                json.dumps(dataset.version), json.dumps(university), body)
+
+        return 404, json.dumps({"error": "unknown path {}".format(path)})
+
+    async def handle(self, reader, writer):
+        """
+        Serve the requests of one connection, kept alive between requests as in HTTP/1.1.
+        Requests have no body, only the request line and the headers are read.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip().lower()
+
+                request = request_line.decode("latin-1").split()
+                if len(request) != 3:
+                    break
+                method, target, version = request
+                try:
+                    status, body = self.route(method, target)
+                except ValueError as error:
+                    # Malformed filter values, e.g. Points=abc
+                    status, body = 400, json.dumps({"error": str(error)})
+
+                connection = headers.get("connection", "")
+                keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+                body = body.encode("utf-8")
+                writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n"
+                             "Connection: {}\r\n\r\n".format(status, REASONS[status], len(body),
+                                                            "keep-alive" if keep_alive else "close")
+                             .encode("latin-1") + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8080, ready=None):
+        """
+        Load the data, then serve until cancelled.
+        :param port: port to listen on, 0 picks a free port stored in self.port
+        :param ready: optional asyncio.Event set once the service accepts connections
+        """
+        await self.reload()
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        watcher = asyncio.create_task(self.watch())
+        self.port = server.sockets[0].getsockname()[1]
+        print("Listening on http://{}:{}".format(host, self.port))
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the comparison data over HTTP. Endpoints: "
+                                                 "/programs?<filters>, /program?university=, "
+                                                 "/weather?university=, /health")
+    parser.add_argument("--data-dir", default="merge_previous",
+                        help="directory of merged.csv and weather_merged.csv, e.g. merge to follow the pipeline")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="seconds between checks for new data")
+    args = parser.parse_args()
+
+    service = QueryService(args.data_dir, args.poll_interval)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
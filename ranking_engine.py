@@ -0,0 +1,133 @@
+"""
+@File name: ranking_engine
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: rank programs by weighted criteria, for many weight profiles at once.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Criteria and the direction counted as better for a positive weight:
+# -1 when a lower value is better, 1 when a higher value is better
+RANKING_FEATURES = {
+    "Out_of_State_Tuition": -1,      # cheaper
+    "Total_criminal_count": -1,      # safer
+    "Temperature_avg": 1,            # warmer
+    "Population_estimate_2022": 1,   # bigger city
+    "Points": 1,
+    "Ranking": -1                    # better ranked
+}
+
+
+def top_k_indices(scores, k):
+    """
+    Get the columns of the k largest scores of every row, largest first.
+    The k-th largest score of a strided sample of the columns is a lower bound of the k-th
+    largest of the whole row, so one comparison pass keeps only a few candidates per row
+    and just those are sorted. When too many scores tie for that to help, every row falls
+    back to a partial selection with argpartition.
+    :param scores: array of shape (rows, columns), k <= columns
+    :param k: number of columns per row
+    :return: array of shape (rows, k)
+    """
+    n_rows, n_columns = scores.shape
+    step = max(1, n_columns // max(2048, 8 * k))
+    sample = scores[:, ::step]
+    if step > 1 and sample.shape[1] >= k:
+        thresholds = np.partition(sample, sample.shape[1] - k, axis=1)[:, sample.shape[1] - k]
+        kept = scores >= thresholds[:, None]
+        if np.count_nonzero(kept) <= scores.size // 8:
+            rows, columns = np.nonzero(kept)
+            # Sort the candidates by row, then by score from the largest, ties by column
+            order = np.lexsort((-scores[rows, columns], rows))
+            starts = np.searchsorted(rows[order], np.arange(n_rows))
+            return columns[order][starts[:, None] + np.arange(k)]
+
+    if k < n_columns:
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        best = np.tile(np.arange(n_columns), (n_rows, 1))
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(best, order, axis=1)
+
+
+def normalize_features(df, features=RANKING_FEATURES):
+    """
+    Min-max scale every criterion to [0, 1] with 1 the better end. A missing value
+    counts as 0.5 so it neither helps nor hurts.
+    :param df: merged program data
+    :param features: dict of column to direction, see RANKING_FEATURES
+    :return: float array of shape (programs, criteria)
+    """
+    values = np.column_stack([pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+                              for column in features])
+    with np.errstate(invalid='ignore'):
+        low = np.nanmin(values, axis=0)
+        high = np.nanmax(values, axis=0)
+    span = np.where(high > low, high - low, 1.0)
+    scaled = (values - low) / span
+    directions = np.array(list(features.values()))
+    scaled = np.where(directions < 0, 1.0 - scaled, scaled)
+    return np.where(np.isnan(scaled), 0.5, scaled)
+
+
+class RankingEngine:
+    def __init__(self, df, features=RANKING_FEATURES):
+        """ Normalize the criteria once into a feature matrix, see normalize_features.
+        The matrix is stored with one row per criterion, so the scores of many weight
+        profiles are a single matrix product.
+        :param df: merged program data
+        :param features: dict of column to direction, see RANKING_FEATURES
+        """
+        self.columns = list(features)
+        self.size = len(df)
+        self.matrix = np.ascontiguousarray(normalize_features(df, features).T, dtype=np.float32)
+
+    def weight_matrix(self, weights):
+        """
+        Turn weight profiles into a matrix with one row per profile. Every row is divided by
+        the sum of its absolute weights, so the scores of all profiles are in [-1, 1].
+        :param weights: dict of criterion to weight, a list of such dicts, or an array
+        of shape (criteria,) or (profiles, criteria) in the order of RANKING_FEATURES
+        :return: float32 array of shape (profiles, criteria)
+        """
+        if isinstance(weights, dict):
+            weights = [weights]
+        if len(weights) and isinstance(weights[0], dict):
+            weights = [[profile.get(column, 0.0) for column in self.columns] for profile in weights]
+        weights = np.atleast_2d(np.asarray(weights, dtype=np.float32))
+        if weights.shape[1] != len(self.columns):
+            raise ValueError("expected {} weights per profile, got {}".format(len(self.columns), weights.shape[1]))
+        totals = np.abs(weights).sum(axis=1, keepdims=True)
+        return weights / np.where(totals > 0, totals, 1)
+
+    def scores(self, weights):
+        """
+        Score every program for every weight profile.
+        :return: array of shape (profiles, programs)
+        """
+        return self.weight_matrix(weights) @ self.matrix
+
+    def top_k(self, weights, k=10, mask=None, chunk_size=256):
+        """
+        Get the k best programs of every weight profile, without sorting whole catalogs.
+        Profiles are scored by chunks, so the score matrix stays small for large catalogs.
+        :param weights: weight profiles, see weight_matrix
+        :param k: number of programs per profile
+        :param mask: optional boolean mask of the programs to rank, e.g. the current filter
+        :param chunk_size: number of profiles scored at a time
+        :return: array of shape (profiles, k) of row positions, best first; k is lowered
+        to the number of programs to rank when there are fewer
+        """
+        weights = self.weight_matrix(weights)
+        candidates = np.arange(self.size) if mask is None else np.flatnonzero(mask)
+        matrix = self.matrix if mask is None else self.matrix[:, candidates]
+        k = min(k, len(candidates))
+
+        result = np.empty((len(weights), k), dtype=np.int64)
+        if k == 0:
+            return result
+        for start in range(0, len(weights), chunk_size):
+            scores = weights[start:start + chunk_size] @ matrix
+            result[start:start + chunk_size] = candidates[top_k_indices(scores, k)]
+        return result
@@ -0,0 +1,256 @@
+"""
+@File name: replay
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: record every upstream response into a snapshot and replay it offline from a local stand-in server.
+"""
+
+import argparse
+import contextlib
+import datetime
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import data_collection as dc
+
+MANIFEST_NAME = "manifest.json"
+
+
+def weather_urls():
+    return [os.path.join(dc.WEATHER_BASE_URL, dc.WEATHER_FILE_TEMPLATE.format(type_, month))
+            for month in dc.WEATHER_MONTHS for type_ in dc.WEATHER_TYPES]
+
+
+def stand_in_path(url):
+    """
+    Get the path a recorded url is served under by the stand-in, e.g.
+    /www2.census.gov/programs-surveys/.../sub-est2022.csv
+    The safety site is a single page app, its export is served as a plain csv file.
+    """
+    if url == dc.SAFETY_URL:
+        return "/ope.ed.gov/campussafety/export.csv"
+    parts = urlsplit(url)
+    return "/" + parts.netloc + parts.path
+
+
+def load_manifest(snapshot_dir):
+    path = os.path.join(snapshot_dir, MANIFEST_NAME)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as fin:
+            return json.load(fin)
+    return {"recorded_at": None, "captures": {}}
+
+
+def add_capture(snapshot_dir, url, path, manifest=None):
+    """
+    Copy one upstream response into a snapshot.
+    Files are named after the sha256 of their content, so unchanged responses are shared.
+    :param snapshot_dir: directory of the snapshot
+    :param url: upstream url the content was downloaded from
+    :param path: path of the downloaded content, e.g. a cache blob or bsyc_temp.txt
+    :param manifest: manifest to update, it is loaded from and written to the snapshot when None
+    """
+    save = manifest is None
+    if save:
+        manifest = load_manifest(snapshot_dir)
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as fin:
+        for block in iter(lambda: fin.read(1024 * 1024), b""):
+            sha256.update(block)
+    digest = sha256.hexdigest()
+
+    os.makedirs(os.path.join(snapshot_dir, "files"), exist_ok=True)
+    target = os.path.join(snapshot_dir, "files", digest)
+    if not os.path.exists(target):
+        shutil.copyfile(path, target)
+    manifest["captures"][url] = {"path": stand_in_path(url), "sha256": digest, "size": os.path.getsize(target)}
+
+    if save:
+        save_manifest(snapshot_dir, manifest)
+
+
+def save_manifest(snapshot_dir, manifest):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    tmp_path = os.path.join(snapshot_dir, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as fout:
+        json.dump(manifest, fout, indent=1)
+    os.replace(tmp_path, os.path.join(snapshot_dir, MANIFEST_NAME))
+
+
+def record(snapshot_dir, headless=True, max_workers=6):
+    """
+    Capture the current response of every upstream source into a snapshot.
+    Responses go through the shared cache, so sources that are still fresh are not downloaded again.
+    :param snapshot_dir: directory of the snapshot, created if needed
+    :param headless: run Chrome without a window when the safety export has to be downloaded
+    :param max_workers: number of files downloaded at the same time
+    :return: the snapshot manifest
+    """
+    if dc.CACHE is None:
+        raise ValueError("recording needs the shared response cache, data_collection.CACHE is None")
+
+    sources = [(dc.POPULATION_URL, "population"), (dc.PROGRAM_URL, "program")]
+    sources += [(url, "weather") for url in weather_urls()]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        paths = dict(zip([url for url, _ in sources],
+                         executor.map(lambda source: dc.fetch_source(*source), sources)))
+
+    # The safety export needs a browser, unless a fresh export is already cached
+    safety_path = dc.CACHE.lookup(dc.SAFETY_URL, dc.CACHE_TTL["safety"])
+    if safety_path is None:
+        dc.download_safety_export(headless=headless)
+        safety_path = dc.CACHE.lookup(dc.SAFETY_URL, dc.CACHE_TTL["safety"])
+    paths[dc.SAFETY_URL] = safety_path
+
+    manifest = load_manifest(snapshot_dir)
+    for url, path in paths.items():
+        add_capture(snapshot_dir, url, path, manifest)
+    manifest["recorded_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+    save_manifest(snapshot_dir, manifest)
+    return manifest
+
+
+class StandInServer:
+    def __init__(self, snapshot_dir, host="127.0.0.1", port=0):
+        """ Local HTTP server answering with the responses recorded in a snapshot.
+        It sends ETag and Last-Modified and answers conditional requests with 304,
+        like the upstream servers, so the response cache behaves as in production.
+        :param snapshot_dir: directory of the snapshot
+        :param host: address to listen on
+        :param port: port to listen on, 0 picks a free port
+        """
+        self.snapshot_dir = snapshot_dir
+        self.manifest = load_manifest(snapshot_dir)
+        if not self.manifest["captures"]:
+            raise ValueError("snapshot {} holds no capture".format(snapshot_dir))
+        self.routes = {capture["path"]: capture for capture in self.manifest["captures"].values()}
+        recorded_at = self.manifest["recorded_at"] or "1970-01-01T00:00:00"
+        self.last_modified = formatdate(datetime.datetime.fromisoformat(recorded_at).timestamp(), usegmt=True)
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                capture = server.routes.get(self.path.split("?")[0])
+                if capture is None:
+                    self.send_error(404, "not recorded in this snapshot")
+                    return
+                etag = '"{}"'.format(capture["sha256"])
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", mimetypes.guess_type(capture["path"])[0] or "text/html")
+                self.send_header("Content-Length", str(capture["size"]))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", server.last_modified)
+                self.end_headers()
+                with open(os.path.join(server.snapshot_dir, "files", capture["sha256"]), "rb") as fin:
+                    shutil.copyfileobj(fin, self.wfile, 1024 * 1024)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def url_for(self, url):
+        return self.base_url + stand_in_path(url)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@contextlib.contextmanager
+def replaying(snapshot_dir, cache=None):
+    """
+    Point every collector to a stand-in server replaying a snapshot until the block exits.
+    :param snapshot_dir: directory of the snapshot
+    :param cache: response cache used while replaying, None streams every response from the
+    stand-in, so every stage always runs
+    :return: the running StandInServer
+    """
+    server = StandInServer(snapshot_dir).start()
+    names = ["POPULATION_URL", "PROGRAM_URL", "WEATHER_BASE_URL", "SAFETY_EXPORT_URL", "CACHE"]
+    previous = {name: getattr(dc, name) for name in names}
+    try:
+        dc.POPULATION_URL = server.url_for(dc.POPULATION_URL)
+        dc.PROGRAM_URL = server.url_for(dc.PROGRAM_URL)
+        dc.WEATHER_BASE_URL = server.url_for(dc.WEATHER_BASE_URL)
+        dc.SAFETY_EXPORT_URL = server.url_for(dc.SAFETY_URL)
+        dc.CACHE = cache
+        yield server
+    finally:
+        for name, value in previous.items():
+            setattr(dc, name, value)
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record upstream responses, or replay them offline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="capture every upstream source into a snapshot")
+    record_parser.add_argument("snapshot")
+    record_parser.add_argument("--show-browser", action="store_true", help="show Chrome for the safety export")
+
+    add_parser = subparsers.add_parser("add", help="add a file as the response of one url, e.g. bsyc_temp.txt")
+    add_parser.add_argument("snapshot")
+    add_parser.add_argument("url")
+    add_parser.add_argument("path")
+
+    replay_parser = subparsers.add_parser("replay", help="run the whole refresh against a snapshot")
+    replay_parser.add_argument("snapshot")
+    replay_parser.add_argument("--workdir", default="replay_output",
+                               help="directory the stage outputs are written to")
+
+    serve_parser = subparsers.add_parser("serve", help="only run the stand-in server")
+    serve_parser.add_argument("snapshot")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        manifest = record(args.snapshot, headless=not args.show_browser)
+        print("Recorded {} responses into {}".format(len(manifest["captures"]), args.snapshot))
+    elif args.command == "add":
+        add_capture(args.snapshot, args.url, args.path)
+    elif args.command == "replay":
+        from pipeline import refresh
+
+        snapshot_dir = os.path.abspath(args.snapshot)
+        os.makedirs(args.workdir, exist_ok=True)
+        os.chdir(args.workdir)
+        with replaying(snapshot_dir):
+            refresh(force=True)
+        print("Replayed {} into {}".format(args.snapshot, os.getcwd()))
+    else:
+        server = StandInServer(args.snapshot, port=args.port)
+        print("Serving {} on {}".format(args.snapshot, server.base_url))
+        for url, capture in sorted(server.manifest["captures"].items()):
+            print("  {} -> {}".format(url, server.base_url + capture["path"]))
+        server.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+@File name: similar_programs
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: find the programs closest to a given one by tuition, safety, climate, city size and ranking.
+"""
+
+import numpy as np
+
+from ranking_engine import normalize_features, top_k_indices
+
+try:
+    from scipy.spatial import cKDTree  # KD-tree search is optional, brute force is always available
+    HAS_SCIPY = True
+except ImportError:
+    HAS_SCIPY = False
+
+# Columns compared between programs, with the same directions as the ranking
+SIMILARITY_FEATURES = {
+    "Out_of_State_Tuition": -1,
+    "Total_criminal_count": -1,
+    "Temperature_avg": 1,
+    "Population_estimate_2022": 1,
+    "Ranking": -1
+}
+
+# dataset version -> SimilarityIndex, only the latest version is kept
+similarity_cache = {}
+
+
+class SimilarityIndex:
+    def __init__(self, df, features=SIMILARITY_FEATURES):
+        """ Nearest-neighbour index over the normalized features of every program.
+        Every feature is scaled to [0, 1], so they all weigh the same in the distance.
+        :param df: merged program data
+        :param features: dict of column to direction, see ranking_engine.RANKING_FEATURES
+        """
+        self.size = len(df)
+        self.matrix = np.ascontiguousarray(normalize_features(df, features))
+        # Squared norms, so the brute-force distances are a single matrix-vector product
+        self.norms = (self.matrix ** 2).sum(axis=1)
+        self.rows_by_university = {university: row for row, university in enumerate(df["University"])}
+        self.tree = cKDTree(self.matrix) if HAS_SCIPY and self.size else None
+
+    def nearest(self, row, k=10, mask=None):
+        """
+        Get the k programs closest to one program, closest first, the program itself excluded.
+        When the allowed programs are a large part of the catalog, the KD-tree is queried for
+        a few extra neighbours until k of them are allowed; without scipy the distances to all
+        programs are computed at once. A small filter only computes the distances to its programs.
+        :param row: row position of the program
+        :param k: number of programs
+        :param mask: optional boolean mask of the programs allowed, e.g. the current filter
+        :return: array of at most k row positions
+        """
+        allowed = np.ones(self.size, dtype=bool) if mask is None else np.array(mask, dtype=bool)
+        allowed[row] = False
+        n_allowed = int(np.count_nonzero(allowed))
+        k = min(k, n_allowed)
+        if k == 0:
+            return np.empty(0, dtype=np.int64)
+        point = self.matrix[row]
+
+        if n_allowed * 4 >= self.size:
+            if self.tree is not None:
+                count = k + 1
+                while True:
+                    rows = self.tree.query(point, k=min(count, self.size))[1]
+                    rows = rows[allowed[rows]]
+                    if len(rows) >= k or count >= self.size:
+                        return rows[:k]
+                    count *= 4
+            candidates = None
+            # |a - b|^2 = |a|^2 - 2 a.b + |b|^2, the last term is the same for every program
+            distances = np.where(allowed, self.norms - 2 * (self.matrix @ point), np.inf)
+        else:
+            candidates = np.flatnonzero(allowed)
+            distances = self.norms[candidates] - 2 * (self.matrix[candidates] @ point)
+
+        best = top_k_indices(-distances[None, :], k)[0]
+        return best if candidates is None else candidates[best]
+
+    def similar(self, university, k=10, mask=None):
+        """
+        Get the k programs closest to a university.
+        :param university: name of the university, as in the University column
+        :return: array of at most k row positions, closest first
+        """
+        if university not in self.rows_by_university:
+            raise KeyError("unknown university {}".format(university))
+        return self.nearest(self.rows_by_university[university], k, mask)
+
+
+def similarity_index(df, version):
+    """
+    Get the SimilarityIndex of a dataset, built only when the dataset version changes.
+    :param df: merged program data
+    :param version: dataset version of df, see data_store.dataset_version
+    """
+    if version not in similarity_cache:
+        similarity_cache.clear()
+        similarity_cache[version] = SimilarityIndex(df)
+    return similarity_cache[version]
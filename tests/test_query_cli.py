@@ -0,0 +1,32 @@
+"""
+@File name: test_query_cli
+@Andrew IDS: yangyond, hhe3, mfouad, ziruiw2
+@Purpose: check that a batch of saved filter profiles carries on past malformed ones.
+"""
+
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+import fixtures
+from query_cli import load_programs, read_queries, run_queries
+
+
+def test_malformed_values_do_not_stop_the_batch(tmp_path, capsys):
+    fixtures.write_merged_outputs(str(tmp_path), 200)
+    df, index = load_programs(os.path.join(str(tmp_path), "merged.csv"))
+    lines = ['{"id": "bad-ranking", "Ranking": "Top"}',
+             '{"id": "bad-points", "Points": "5"}',
+             '{"id": "top20", "Ranking": "Top20"}']
+
+    out = io.StringIO()
+    errors = run_queries(df, index, read_queries(lines), count_only=True, out=out)
+
+    assert errors == 2
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == [{"query": "top20", "count": 20}]
+    stderr = capsys.readouterr().err
+    assert "query bad-ranking: invalid value" in stderr
+    assert "query bad-points: invalid value" in stderr